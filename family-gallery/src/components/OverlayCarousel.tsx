@@ -8,9 +8,10 @@ import {
   BASE_IMAGE_HEIGHT,
 } from "../App";
 import SoloPhotoOverlay from "./SoloPhotoOverlay";
+import { renditionVersion } from "../utils/utils";
 
 interface OverlayCarouselProps {
-  photoIndex: { filename: string }[];
+  photoIndex: { filename: string; angle?: number; etag?: string }[];
   startIndex: number;
   onClose: () => void;
   onPrev: () => void;
@@ -35,12 +36,17 @@ const OverlayCarousel: React.FC<OverlayCarouselProps> = ({
   const [currentIndex, setCurrentIndex] = useState(startIndex);
   const [loadingMap, setLoadingMap] = useState<{ [filename: string]: string }>({});
   const [soloPhoto, setSoloPhoto] = useState<string | null>(null);
+  const [angles, setAngles] = useState<{ [filename: string]: number }>({});
 
   const safeEncodePath = (path: string) =>
     path.split("/").map(encodeURIComponent).join("/");
 
-  const getImageUrl = (filename: string) =>
-    `${GLOBAL_BACKEND_URL}/serve-image/${safeEncodePath(filename)}`;
+  // ?v= is the rendition version (angle + original's ETag); the backend marks versioned URLs immutable
+  const getImageUrl = (filename: string, angle?: number) => {
+    const entry = photoIndex.find((p) => p.filename === filename);
+    const version = renditionVersion(angle ?? angles[filename] ?? entry?.angle ?? 0, entry?.etag);
+    return `${GLOBAL_BACKEND_URL}/serve-image/${safeEncodePath(filename)}?v=${version}`;
+  };
 
   const visiblePhotos = photoIndex.slice(currentIndex, currentIndex + 3);
   const largeFrame = frameToLargeFrameMap[selectedFrame] || selectedFrame;
@@ -96,12 +102,18 @@ const OverlayCarousel: React.FC<OverlayCarouselProps> = ({
     console.log(`[Overlay] Rotating: ${filename}`);
     setLoadingMap((prev) => ({ ...prev, [filename]: "Updating Photo..." }));
 
+    let newAngle: number | null = null;
     try {
-      await fetch(`${GLOBAL_BACKEND_URL}/photo-index/rotate`, {
+      const res = await fetch(`${GLOBAL_BACKEND_URL}/photo-index/rotate`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ filename }),
       });
+      const data = await res.json();
+      if (typeof data.angle === "number") {
+        newAngle = data.angle;
+        setAngles((prev) => ({ ...prev, [filename]: data.angle }));
+      }
     } catch (err) {
       console.error("Error rotating photo:", err);
     }
@@ -113,9 +125,8 @@ const OverlayCarousel: React.FC<OverlayCarouselProps> = ({
     });
 
     const img = document.getElementById(`photo-${filename}`) as HTMLImageElement | null;
-    if (img) {
-      const cleanUrl = getImageUrl(filename).split("?")[0];
-      img.src = `${cleanUrl}?t=${Date.now()}`;
+    if (img && newAngle !== null) {
+      img.src = getImageUrl(filename, newAngle);
     }
   };
 
@@ -162,7 +173,11 @@ const OverlayCarousel: React.FC<OverlayCarouselProps> = ({
               />
               <img
                 id={`photo-${photo.filename}`}
-                src={preloadedUrls[photo.filename] || getImageUrl(photo.filename)}
+                src={
+                  photo.filename in angles
+                    ? getImageUrl(photo.filename)
+                    : preloadedUrls[photo.filename] || getImageUrl(photo.filename)
+                }
                 alt={`Overlay ${idx}`}
                 className="overlay-photo"
                 style={{
@@ -207,7 +222,7 @@ const OverlayCarousel: React.FC<OverlayCarouselProps> = ({
           filename={soloPhoto}
           frameImage={largeFrame}
           backgroundImage={selectedBackground}
-          imageUrl={getImageUrl(soloPhoto)}
+          imageUrl={`${getImageUrl(soloPhoto)}&size=large`}
           onClose={() => setSoloPhoto(null)}
         />
       )}
@@ -2,6 +2,9 @@ import React, { useEffect, useState } from "react";
 import { GLOBAL_BACKEND_URL } from "../App";
 import "./css/ServeVideoThumbnail.css";
 
+// Must match VIDEO_THUMB_VERSION in the backend
+const VIDEO_THUMB_VERSION = "1";
+
 interface ServeVideoThumbnailProps {
   filename: string;
 }
@@ -16,10 +19,10 @@ const ServeVideoThumbnail: React.FC<ServeVideoThumbnailProps> = ({ filename }) =
   const loadThumbnail = async () => {
     setStatus("loading");
     const encodedFilename = safeEncode(filename);
-    const url = `${GLOBAL_BACKEND_URL}/cache-video/${encodedFilename}.jpg`;
+    const url = `${GLOBAL_BACKEND_URL}/cache-video/${encodedFilename}.jpg?v=${VIDEO_THUMB_VERSION}`;
 
     try {
-      const res = await fetch(`${url}?t=${Date.now()}`);
+      const res = await fetch(url);
       if (res.status === 200) {
         setThumbnailUrl(url);
         setStatus("ready");
@@ -34,8 +37,7 @@ const ServeVideoThumbnail: React.FC<ServeVideoThumbnailProps> = ({ filename }) =
         );
         if (genRes.ok) {
           // Retry thumbnail load
-          const retryUrl = `${url}?t=${Date.now()}`;
-          setThumbnailUrl(retryUrl);
+          setThumbnailUrl(url);
           setStatus("ready");
         } else {
           throw new Error("Thumbnail generation failed");
@@ -5,6 +5,7 @@ import SelectorPhotos, { frameToLargeFrameMap } from "../components/Selector_Pho
 import GoBackButton from "../components/GoBackButton";
 import OverlayCarousel from "../components/OverlayCarousel";
 import { GLOBAL_BACKEND_URL } from "../App";
+import { renditionVersion } from "../utils/utils";
 
 const TOTAL_TO_DISPLAY = 15;
 const CHUNK_SIZE = 15;
@@ -26,7 +27,7 @@ const Photos: React.FC = () => {
   const [toYear, setToYear] = useState(2025);
   const [hasFaces, setHasFaces] = useState(true);
 
-  const [photoIndex, setPhotoIndex] = useState<{ filename: string }[]>([]);
+  const [photoIndex, setPhotoIndex] = useState<{ filename: string; angle?: number; etag?: string }[]>([]);
   const [deletedPhotos, setDeletedPhotos] = useState<Set<string>>(new Set());
 
   const [overlayVisible, setOverlayVisible] = useState(false);
@@ -49,9 +50,12 @@ const Photos: React.FC = () => {
     };
   }, []);
 
-  const fetchChunk = async (): Promise<any[]> => {
+  // The backend deals from a shuffled deck per from/to/hasFaces, so photos
+  // only repeat once it runs out; clear=true reshuffles it. Only the first
+  // fetch after loading or changing the filters asks for that.
+  const fetchChunk = async (clear = false): Promise<any[]> => {
     const res = await fetch(
-      `${GLOBAL_BACKEND_URL}/photo-index/random-chunk?from=${fromYear}&to=${toYear}&size=${CHUNK_SIZE}&clear=true&hasFaces=${hasFaces}`
+      `${GLOBAL_BACKEND_URL}/photo-index/random-chunk?from=${fromYear}&to=${toYear}&size=${CHUNK_SIZE}&clear=${clear}&hasFaces=${hasFaces}`
     );
     return res.json();
   };
@@ -62,7 +66,7 @@ const Photos: React.FC = () => {
     const newPreloaded: { [filename: string]: string } = {};
     const urls = await Promise.all(
       photos.map((photo) => {
-        const url = `${GLOBAL_BACKEND_URL}/serve-image/${safeEncodePath(photo.filename)}`;
+        const url = `${GLOBAL_BACKEND_URL}/serve-image/${safeEncodePath(photo.filename)}?v=${renditionVersion(photo.angle ?? 0, photo.etag)}`;
         newPreloaded[photo.filename] = url;
         return new Promise<string>((resolve) => {
           const img = new Image();
@@ -75,8 +79,8 @@ const Photos: React.FC = () => {
     return urls;
   };
 
-  const refillChunks = async () => {
-    const newPhotos = await fetchChunk();
+  const refillChunks = async (clear = false) => {
+    const newPhotos = await fetchChunk(clear);
     const visiblePhotos = newPhotos.filter((p) => !deletedPhotos.has(p.filename));
     const newImages = await preloadImages(visiblePhotos);
     setChunks((prev) => [...prev, newImages]);
@@ -92,7 +96,7 @@ const Photos: React.FC = () => {
 
         const count = ROTATION ? TOTAL_TO_DISPLAY / CHUNK_SIZE : 1;
         for (let i = 0; i < count; i++) {
-          await refillChunks();
+          await refillChunks(i === 0);
         }
         setLoading(false);
       } catch (err) {
@@ -190,7 +194,7 @@ useEffect(() => {
       const freshChunks: string[][] = [];
 
       for (let i = 0; i < count; i++) {
-        const newPhotos = await fetchChunk();
+        const newPhotos = await fetchChunk(i === 0);
         //console.log(`📸 Chunk ${i + 1}: fetched ${newPhotos.length} photos`);
 
         const visiblePhotos = newPhotos.filter((p) => !deletedPhotos.has(p.filename));
@@ -234,7 +238,7 @@ useEffect(() => {
   
 
   const handleImageClick = (url: string) => {
-    const fullPath = url.split("/serve-image/")[1] || "";
+    const fullPath = (url.split("/serve-image/")[1] || "").split("?")[0];
     const filename = decodeURIComponent(fullPath.trim());
     const index = photoIndex.findIndex(
       (p) => decodeURIComponent((p.filename || "").trim().toLowerCase()) === filename.toLowerCase()
@@ -40,4 +40,13 @@ export function logToBackend(message: string, level: "info" | "warn" | "error" |
     .catch((err) => {
       console.warn("Failed to log to backend:", err);
     });
-}
\ No newline at end of file
+}
+
+/**
+ * The ?v= for a /serve-image URL: the angle, plus the start of the original's
+ * ETag when the index has one. Must match rendition_version() in the backend,
+ * which only marks URLs carrying the current version as immutable.
+ */
+export function renditionVersion(angle: number, etag?: string): string {
+  return etag ? `${angle}.${etag.slice(0, 8)}` : `${angle}`;
+}
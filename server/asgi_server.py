@@ -0,0 +1,248 @@
+import os
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+
+from photos_videos_server import (
+    app as flask_app,
+    photo_index,
+    thumb_cache,
+    rendition_etag,
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    HLS_SEGMENT_CACHE_CONTROL,
+    S3_BUCKET,
+    S3_VIDEO_THUMB_PREFIX,
+    VIDEO_THUMB_VERSION,
+)
+from s3_client import S3_ENDPOINT_URL
+from renditions import RENDITION_SIZES, original_key, parse_rendition_width, rendition_key, rendition_version
+from s3_stream import STREAM_CHUNK_SIZE, VIDEO_RANGE_WINDOW, clamp_open_range, content_disposition, _if_range_allows
+from video_hls import S3_HLS_PREFIX, hls_mimetype
+from video_thumbnails import cache_mimetype, video_key, video_mimetype
+
+# --- ASGI CONFIGURATION ---
+# Run with: uvicorn asgi_server:app --host 0.0.0.0 --port 8001
+ASYNC_S3_CONNECTIONS = int(os.getenv("ASYNC_S3_CONNECTIONS", "100"))
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "8"))
+
+HTTP_DATE = "%a, %d %b %Y %H:%M:%S GMT"
+
+
+# --- ASYNC SERVING MODE ---
+# The routes that mostly wait on S3 (rendition and video thumbnail cache
+# hits, photo downloads, video streaming and HLS) are served here on the
+# event loop with a non-blocking S3 client, so one process can keep
+# hundreds of fetches in flight. They share the index and disk cache with
+# the Flask app, which still handles everything else (and renders cache
+# misses) from a thread pool behind the same URLs.
+flask_wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    config = AioConfig(max_pool_connections=ASYNC_S3_CONNECTIONS)
+    async with get_session().create_client("s3", endpoint_url=S3_ENDPOINT_URL, config=config) as s3:
+        app.state.s3 = s3
+        yield
+
+
+def rendition_cache_control(request, version):
+    return IMMUTABLE_CACHE_CONTROL if request.query_params.get("v") == str(version) else REVALIDATE_CACHE_CONTROL
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# Disk cache, then the S3 cache prefix. Returns None when the key is in
+# neither, so the caller can decide what a miss means.
+async def serve_cached(request, cache_key, mimetype, version, source_etag=None):
+    etag = rendition_etag(cache_key, source_etag)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": rendition_cache_control(request, version)}
+    if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+        return Response(status_code=304, headers=headers)
+
+    data = None
+    cached_path = thumb_cache.get(cache_key)
+    if cached_path:
+        try:
+            data = await run_in_threadpool(read_file, cached_path)
+        except FileNotFoundError:
+            print(f"[CACHE] Evicted before send: {cache_key}")
+
+    if data is None:
+        try:
+            response = await request.app.state.s3.get_object(Bucket=S3_BUCKET, Key=cache_key)
+            async with response["Body"] as body:
+                data = await body.read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None
+            print(f"[S3 ERROR] Failed to fetch cache {cache_key}:", e)
+            return Response(status_code=500)
+        await run_in_threadpool(thumb_cache.put, cache_key, data)
+
+    return Response(data, media_type=mimetype, headers=headers)
+
+
+# Syncing may replay or reload the index from SQLite and get() waits on the
+# index lock, so both run on the thread pool, never on the event loop.
+def current_entry(filename):
+    photo_index.sync()
+    return photo_index.get(filename)
+
+
+# --- ROUTES ---
+async def serve_image(request):
+    filename = request.path_params["filename"]
+    image_entry = await run_in_threadpool(current_entry, filename)
+    if not image_entry:
+        print(f"[404] Not in photo_index: {filename}")
+        return Response(status_code=404)
+
+    width = parse_rendition_width(request.query_params.get("size"))
+    if width is None:
+        return JSONResponse({"error": f"Unknown size, use one of {sorted(RENDITION_SIZES)}"}, status_code=400)
+
+    angle = image_entry.get("angle", 0)
+    response = await serve_cached(
+        request, rendition_key(filename, angle, width), "image/webp",
+        rendition_version(image_entry), image_entry.get("etag"),
+    )
+    # Not rendered anywhere yet: the Flask route renders it on the image pool
+    return response or flask_wsgi
+
+
+async def serve_video_thumbnail(request):
+    cache_key = f"{S3_VIDEO_THUMB_PREFIX}/{request.path_params['filename']}"
+    response = await serve_cached(request, cache_key, cache_mimetype(cache_key), VIDEO_THUMB_VERSION)
+    if response is None:
+        print(f"[404 DEBUG] Key not found: {cache_key}")
+        # Not generated yet: don't let the browser cache the miss
+        return Response(status_code=404, headers={"Cache-Control": "no-store"})
+    return response
+
+
+async def download_photo(request):
+    filename = request.path_params["filename"]
+    return await stream_s3_object(
+        request, request.app.state.s3, S3_BUCKET, original_key(filename),
+        download_name=os.path.basename(filename),
+    )
+
+
+async def stream_video(request):
+    filename = request.path_params["filename"]
+    return await stream_s3_object(
+        request, request.app.state.s3, S3_BUCKET, video_key(filename),
+        mimetype=video_mimetype(filename), max_range=VIDEO_RANGE_WINDOW,
+    )
+
+
+async def serve_hls(request):
+    key = request.path_params["key"]
+    response = await stream_s3_object(
+        request, request.app.state.s3, S3_BUCKET, f"{S3_HLS_PREFIX}/{key}", mimetype=hls_mimetype(key),
+    )
+    if response.status_code in (200, 206):
+        response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL if key.endswith(".m3u8") else HLS_SEGMENT_CACHE_CONTROL
+    return response
+
+
+# --- S3 STREAMING ---
+# Same contract as s3_stream.stream_s3_object: Range passed through to S3,
+# If-Range checked against the object's ETag/Last-Modified, 416 for
+# unsatisfiable ranges.
+async def stream_s3_object(request, s3, bucket, key, mimetype=None, download_name=None, chunk_size=STREAM_CHUNK_SIZE, max_range=None):
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+
+    params = {"Bucket": bucket, "Key": key}
+    try:
+        if range_header and if_range:
+            head = await s3.head_object(Bucket=bucket, Key=key)
+            if not _if_range_allows(if_range, head.get("ETag"), head["LastModified"].strftime(HTTP_DATE)):
+                range_header = None
+            else:
+                params["IfMatch"] = head["ETag"]  # don't splice ranges of two different versions
+        if range_header and max_range:
+            range_header = clamp_open_range(range_header, max_range)
+        if range_header:
+            params["Range"] = range_header
+
+        try:
+            s3_response = await s3.get_object(**params)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "PreconditionFailed":
+                raise
+            # Object changed between HEAD and GET: send the new one in full
+            params.pop("Range", None)
+            params.pop("IfMatch", None)
+            s3_response = await s3.get_object(**params)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ("NoSuchKey", "404"):
+            print(f"[404] S3 Key Not Found: {key}")
+            return Response(status_code=404)
+        if code == "InvalidRange":
+            size = e.response["Error"].get("ActualObjectSize")
+            headers = {"Content-Range": f"bytes */{size}"} if size else {}
+            return Response(status_code=416, headers=headers)
+        print(f"[ERROR] S3 stream failed for {key}: {e}")
+        return Response(status_code=500)
+
+    body = s3_response["Body"]
+
+    async def generate():
+        async with body:
+            async for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(s3_response["ContentLength"]),
+    }
+    if s3_response.get("ETag"):
+        headers["ETag"] = s3_response["ETag"]
+    if s3_response.get("LastModified"):
+        headers["Last-Modified"] = s3_response["LastModified"].strftime(HTTP_DATE)
+    if s3_response.get("ContentRange"):
+        headers["Content-Range"] = s3_response["ContentRange"]
+    if download_name:
+        headers["Content-Disposition"] = content_disposition(download_name)
+
+    return StreamingResponse(
+        generate(),
+        status_code=206 if s3_response.get("ContentRange") else 200,
+        media_type=mimetype or s3_response.get("ContentType", "application/octet-stream"),
+        headers=headers,
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/serve-image/{filename:path}", serve_image),
+        Route("/cache-video/{filename:path}", serve_video_thumbnail),
+        Route("/download-photo/{filename:path}", download_photo),
+        Route("/stream-video/{filename:path}", stream_video),
+        Route("/hls/{key:path}", serve_hls),
+        Mount("/", app=flask_wsgi),
+    ],
+    middleware=[
+        # Same permissive policy flask-cors applies to the Flask app
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
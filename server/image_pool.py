@@ -0,0 +1,82 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from renditions import render_thumbnails
+
+# --- IMAGE POOL CONFIGURATION ---
+# Each gunicorn worker owns a pool, so by default the cores are split
+# between the WEB_CONCURRENCY workers started in Dockerfile.prod.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // WEB_CONCURRENCY))))
+IMAGE_POOL_QUEUE = int(os.getenv("IMAGE_POOL_QUEUE", str(IMAGE_POOL_WORKERS * 2)))
+IMAGE_POOL_TIMEOUT = float(os.getenv("IMAGE_POOL_TIMEOUT", "30"))
+IMAGE_POOL_RETRY_AFTER = int(os.getenv("IMAGE_POOL_RETRY_AFTER", "2"))
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# --- IMAGE POOL ---
+# Decode/resize/encode runs in separate processes so request threads only
+# wait on a future. At most workers + queue renders are admitted at once;
+# anything beyond that fails fast with PoolBusy so the caller can answer
+# 503 + Retry-After instead of piling up behind the CPU.
+class ImagePool:
+    def __init__(self, workers=IMAGE_POOL_WORKERS, queue=IMAGE_POOL_QUEUE, timeout=IMAGE_POOL_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    # Created lazily so each gunicorn worker gets its own pool after fork;
+    # spawn keeps pool processes from inheriting threads and sockets.
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.executor
+
+    def _reset(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PoolBusy()
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        # The slot is held until the render really ends, even if the caller
+        # stops waiting, so timed-out work still counts against the bound.
+        future.add_done_callback(lambda _: self.slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PoolTimeout()
+        except BrokenProcessPool:
+            self._reset()  # a worker died (OOM on a huge original); start fresh next time
+            raise
+
+    def render_thumbnails(self, data, angle, widths):
+        return self.run(render_thumbnails, data, angle, tuple(widths))
+
+    def shutdown(self):
+        self._reset()
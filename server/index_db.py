@@ -0,0 +1,381 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+from photo_index_store import extract_year, is_hidden_file
+
+PHOTO_INDEX_DB = os.getenv("PHOTO_INDEX_DB", "cache/photo_index.db")
+PHOTO_INDEX_JSON = "cache/photo_index.json"
+PHOTO_INDEX_JOURNAL = "cache/photo_index.journal"
+DELETED_PHOTOS_JSON = "cache/deleted_photos.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL UNIQUE,
+    year INTEGER,
+    has_faces INTEGER NOT NULL DEFAULT 0,
+    angle INTEGER NOT NULL DEFAULT 0,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS photos_year ON photos (year, seq);
+CREATE INDEX IF NOT EXISTS photos_has_faces ON photos (has_faces, year);
+CREATE TABLE IF NOT EXISTS deleted (
+    filename TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    photo INTEGER,
+    entry TEXT
+);
+CREATE TABLE IF NOT EXISTS decks (
+    key TEXT PRIMARY KEY,
+    lo INTEGER NOT NULL,
+    hi INTEGER NOT NULL,
+    layout INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    cursor INTEGER NOT NULL,
+    used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS videos (
+    filename TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# The change log only has to cover how far a worker can fall behind
+CHANGE_LOG_KEEP = int(os.getenv("CHANGE_LOG_KEEP", "50000"))
+CHANGE_LOG_PRUNE_EVERY = 1000
+# Seconds a write waits for another connection's write lock
+DB_TIMEOUT = 30
+
+
+def _columns(entry):
+    return (
+        extract_year(entry),
+        1 if entry.get("hasFaces") else 0,
+        entry.get("angle") or 0,
+        json.dumps(entry),
+    )
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+# Angle changes appended by rotate before the index moved to SQLite
+def _read_journal(path):
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # torn last line from a crash mid-append
+    except FileNotFoundError:
+        pass
+    return records
+
+
+# --- INDEX DATABASE ---
+# Durable copy of the photo index in SQLite (WAL mode, so both gunicorn
+# workers read while one writes). One row per photo: the full entry as JSON
+# plus the columns queries filter on (filename, year, hasFaces, angle).
+# Every mutation is a row-level statement in a transaction; nothing rewrites
+# the whole index. Connections are per thread.
+#
+# It is also how the workers share state: each mutation appends to the
+# `changes` log in the same transaction, and the other workers replay the
+# log (see PhotoIndex.sync) when PRAGMA data_version says another
+# connection committed. Sampler decks live in the `decks` table.
+class IndexDB:
+    def __init__(self, path=PHOTO_INDEX_DB):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=DB_TIMEOUT, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.depth = 0
+            self.local.data_version = None
+        return db
+
+    # Nestable: only the outermost block opens and commits (or rolls back).
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        db = self.connection()
+        if self.local.depth == 0:
+            db.execute(f"BEGIN {mode}")
+        self.local.depth += 1
+        try:
+            yield db
+        except BaseException:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                db.execute("ROLLBACK")
+            raise
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            db.execute("COMMIT")
+
+    # A read transaction: one consistent view for several reads. It takes no
+    # write lock, so it never waits (WAL readers don't block on writers).
+    def snapshot(self):
+        return self.transaction("DEFERRED")
+
+    # Lowers how long writes on this thread's connection wait for the write
+    # lock, for writes that are better skipped than waited for.
+    @contextmanager
+    def busy_timeout(self, seconds):
+        db = self.connection()
+        db.execute(f"PRAGMA busy_timeout = {int(seconds * 1000)}")
+        try:
+            yield
+        finally:
+            db.execute(f"PRAGMA busy_timeout = {DB_TIMEOUT * 1000}")
+
+    # --- READS ---
+    # Returns ((seq, entry) pairs in insertion order, deleted filenames).
+    # Entries are decoded lazily so loading never holds every dict at once.
+    def load(self):
+        db = self.connection()
+        deleted = {row[0] for row in db.execute("SELECT filename FROM deleted")}
+        rows = ((seq, json.loads(entry)) for seq, entry in db.execute("SELECT seq, entry FROM photos ORDER BY seq"))
+        return rows, deleted
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+
+    # --- CHANGE LOG ---
+    # True when another connection (another worker, or another thread of
+    # this one) committed since this thread last asked. Costs one pragma.
+    def poll(self):
+        version = self.connection().execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self.local.data_version
+        self.local.data_version = version
+        return changed
+
+    def last_change(self):
+        row = self.connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    # [(seq, op, filename, photo seq, entry)] after `seq`, oldest first, or
+    # None when the log has been pruned past `seq` (the caller must reload).
+    # Sequence numbers have no gaps: a rolled-back change gives its seq back.
+    def changes_since(self, seq, limit=-1):
+        rows = self.connection().execute(
+            "SELECT seq, op, filename, photo, entry FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+        ).fetchall()
+        if rows and rows[0][0] != seq + 1:
+            return None
+        return [(s, op, filename, photo, json.loads(entry) if entry else None) for s, op, filename, photo, entry in rows]
+
+    def _log(self, db, op, filename, photo=None, entry=None):
+        seq = db.execute(
+            "INSERT INTO changes (op, filename, photo, entry) VALUES (?, ?, ?, ?)",
+            (op, filename, photo, json.dumps(entry) if entry is not None else None),
+        ).lastrowid
+        if seq % CHANGE_LOG_PRUNE_EVERY == 0:
+            db.execute("DELETE FROM changes WHERE seq <= ?", (seq - CHANGE_LOG_KEEP,))
+
+    # Bumped by every write that shifts positions in the year-sorted layout
+    # (adds, removals, year changes); shared decks are only valid within one.
+    def layout_version(self):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_layout(self, db):
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES ('layout', 1) "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    # --- WRITES ---
+    # Returns the photo's seq (its position in insertion order).
+    def insert(self, entry):
+        with self.transaction() as db:
+            self.insert_many([entry])
+            return db.execute("SELECT seq FROM photos WHERE filename = ?", (entry["filename"],)).fetchone()[0]
+
+    def insert_many(self, entries, log=True):
+        with self.transaction() as db:
+            inserted = 0
+            for e in entries:
+                if is_hidden_file(e["filename"]):
+                    continue
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO photos (filename, year, has_faces, angle, entry) VALUES (?, ?, ?, ?, ?)",
+                    (e["filename"], *_columns(e)),
+                )
+                if cursor.rowcount:
+                    inserted += 1
+                    if log:
+                        self._log(db, "add", e["filename"], cursor.lastrowid, e)
+            if inserted:
+                self._bump_layout(db)
+
+    def save(self, entry):
+        with self.transaction() as db:
+            columns = _columns(entry)
+            old = db.execute("SELECT year FROM photos WHERE filename = ?", (entry["filename"],)).fetchone()
+            db.execute(
+                "UPDATE photos SET year = ?, has_faces = ?, angle = ?, entry = ? WHERE filename = ?",
+                (*columns, entry["filename"]),
+            )
+            if old is None:
+                return
+            self._log(db, "save", entry["filename"], entry=entry)
+            if old[0] != columns[0]:
+                self._bump_layout(db)
+
+    def remove_many(self, filenames):
+        rows = [(f,) for f in filenames]
+        with self.transaction() as db:
+            db.executemany("DELETE FROM photos WHERE filename = ?", rows)
+            db.executemany("DELETE FROM deleted WHERE filename = ?", rows)
+            for (filename,) in rows:
+                self._log(db, "remove", filename)
+            if rows:
+                self._bump_layout(db)
+
+    def mark_deleted(self, filename):
+        with self.transaction() as db:
+            if db.execute("INSERT OR IGNORE INTO deleted (filename) VALUES (?)", (filename,)).rowcount:
+                self._log(db, "delete", filename)
+
+    # --- SAMPLER DECKS ---
+    # (lo, hi, layout, seed, cursor) per from/to/hasFaces key; the least
+    # recently used decks beyond `keep` are dropped.
+    def load_deck(self, key):
+        return self.connection().execute(
+            "SELECT lo, hi, layout, seed, cursor FROM decks WHERE key = ?", (key,)
+        ).fetchone()
+
+    # Compare-and-swap: saves `deck` only if the row still holds `expected`
+    # (what load_deck returned, None for no row), so two workers dealing
+    # from the same deck can't both advance it from one cursor. Returns
+    # False when another worker got there first. Waits at most `timeout`
+    # seconds for the write lock (sqlite3.OperationalError past that).
+    def swap_deck(self, key, expected, deck, keep, timeout=DB_TIMEOUT):
+        with self.busy_timeout(timeout), self.transaction() as db:
+            if self.load_deck(key) != expected:
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO decks (key, lo, hi, layout, seed, cursor, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, *deck, time.time()),
+            )
+            db.execute("DELETE FROM decks WHERE key NOT IN (SELECT key FROM decks ORDER BY used DESC LIMIT ?)", (keep,))
+            return True
+
+    def clear_decks(self):
+        with self.transaction() as db:
+            db.execute("DELETE FROM decks")
+
+    # --- VIDEO INDEX ---
+    # One row per video under videos/originals/ (listing metadata plus what
+    # ffprobe found, see video_index.py). Meta key 'videos' counts writes so
+    # each worker's in-memory copy knows when to reload; 'videos_listed_at'
+    # is when S3 was last listed into it.
+    def videos_version(self):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'videos'").fetchone()
+        return int(row[0]) if row else 0
+
+    def videos_listed_at(self):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'videos_listed_at'").fetchone()
+        return float(row[0]) if row else None
+
+    # Returns (version, entries); the version is read first, so at worst the
+    # entries are newer than it and the caller reloads once more.
+    def load_videos(self):
+        db = self.connection()
+        version = self.videos_version()
+        return version, [json.loads(entry) for (entry,) in db.execute("SELECT entry FROM videos")]
+
+    def save_videos(self, entries, removed=(), listed=False):
+        rows = [(e["filename"], json.dumps(e)) for e in entries]
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO videos (filename, entry) VALUES (?, ?)", rows)
+            db.executemany("DELETE FROM videos WHERE filename = ?", [(f,) for f in removed])
+            if rows or removed:
+                db.execute(
+                    "INSERT INTO meta (key, value) VALUES ('videos', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                )
+            if listed:
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('videos_listed_at', ?)", (str(time.time()),))
+
+    # --- MIGRATION ---
+    # One-time import of cache/photo_index.json (plus the rotate journal and
+    # cache/deleted_photos.json) the first time the database is opened.
+    # Returns the number of entries imported; 0 once migrated.
+    def migrate_from_json(self, index_path=PHOTO_INDEX_JSON, deleted_path=DELETED_PHOTOS_JSON, journal_path=PHOTO_INDEX_JOURNAL):
+        with self.transaction() as db:
+            if db.execute("SELECT 1 FROM meta WHERE key = 'migrated_at'").fetchone():
+                return 0
+            by_filename = {}
+            for entry in _read_json(index_path, []):
+                if not is_hidden_file(entry["filename"]):
+                    by_filename.setdefault(entry["filename"], entry)
+            for record in _read_journal(journal_path):
+                entry = by_filename.get(record.pop("filename", None))
+                if entry is not None:
+                    entry.update(record)
+            # Nothing has loaded the index yet, so there is nobody to notify
+            self.insert_many(by_filename.values(), log=False)
+            db.executemany(
+                "INSERT OR IGNORE INTO deleted (filename) VALUES (?)",
+                [(f,) for f in _read_json(deleted_path, [])],
+            )
+            db.execute("INSERT INTO meta (key, value) VALUES ('migrated_at', ?)", (str(time.time()),))
+        if by_filename:
+            print(f"[INDEX DB] Migrated {len(by_filename)} entries from {index_path}")
+        return len(by_filename)
+
+    def export_json(self, path):
+        entries = [entry for _, entry in self.load()[0]]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+        return len(entries)
+
+
+# --- CLI ---
+# --import merges entries from a photo_index.json (e.g. one written by
+# script_to_upload_photos.py); entries already in the database are kept.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Photo index database maintenance")
+    parser.add_argument("--db", default=PHOTO_INDEX_DB)
+    parser.add_argument("--import", dest="import_path", help="merge entries from a photo_index.json")
+    parser.add_argument("--export", dest="export_path", help="write the index out as photo_index.json")
+    args = parser.parse_args()
+
+    index_db = IndexDB(args.db)
+    index_db.migrate_from_json()
+    if args.import_path:
+        before = index_db.count()
+        index_db.insert_many(_read_json(args.import_path, []))
+        print(f"📥 Imported {index_db.count() - before} new entries from {args.import_path}")
+    if args.export_path:
+        print(f"📝 Exported {index_db.export_json(args.export_path)} entries to {args.export_path}")
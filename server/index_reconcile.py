@@ -0,0 +1,196 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import run_cli
+from renditions import S3_ORIGINALS_PREFIX, RENDITION_SIZES, rendition_key
+from thumbnail_cache import DiskCache
+from photo_index_store import PhotoIndex
+from index_db import IndexDB, PHOTO_INDEX_DB
+from s3_client import make_s3_client
+
+S3_BUCKET = "photo-video-repository"
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic")
+RECONCILE_JOB = "reconcile-index"
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "16"))
+# Changes applied per index transaction; the index lock is released between
+# batches so the worker keeps serving while a large diff goes in.
+RECONCILE_BATCH = 500
+RENDITION_ANGLES = (0, 90, 180, 270)
+S3_DELETE_BATCH = 1000  # the most keys one DeleteObjects call takes
+
+
+def is_photo_key(key):
+    name = os.path.basename(key)
+    return key.lower().endswith(PHOTO_EXTENSIONS) and not name.startswith("._")
+
+
+def object_metadata(obj):
+    return {
+        "etag": obj["ETag"].strip('"'),
+        "size": obj["Size"],
+        "last_modified": obj["LastModified"].isoformat(),
+    }
+
+
+# --- LISTING ---
+# The originals are laid out as photos/originals/<year>/..., so the year
+# prefixes are listed concurrently, each with its own paginator. Every
+# object is kept, whatever its extension: an indexed photo is only removed
+# when its object is really gone.
+def list_year_prefixes(s3):
+    prefixes, loose = [], {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{S3_ORIGINALS_PREFIX}/", Delimiter="/"):
+        prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith("/"):
+                loose[obj["Key"]] = object_metadata(obj)
+    return prefixes, loose
+
+
+def list_prefix(s3, prefix):
+    found = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith("/"):
+                found[obj["Key"]] = object_metadata(obj)
+    return found
+
+
+def list_originals(s3, workers=RECONCILE_WORKERS):
+    prefixes, listing = list_year_prefixes(s3)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(prefixes) or 1))) as pool:
+        for found in pool.map(lambda prefix: list_prefix(s3, prefix), prefixes):
+            listing.update(found)
+    strip = len(S3_ORIGINALS_PREFIX) + 1
+    return {key[strip:]: meta for key, meta in listing.items()}
+
+
+# --- DIFF ---
+def new_entry(filename, meta):
+    year = filename.split("/", 1)[0]
+    return {
+        "filename": filename,
+        "date": f"{year}-01-01" if year.isdigit() else None,
+        "camera": None,
+        "angle": 0,
+        "hasFaces": True,  # same default as script_to_upload_photos.py
+        "gps": None,
+        "location": None,
+        **meta,
+    }
+
+
+# Returns (adds, removals, refreshed, replaced). Only photo extensions are
+# added, but removals are checked against every listed key (uploads through
+# /photo-index/add can be any type). `refreshed` are entries whose stored
+# ETag/size/last-modified is missing or stale; only their metadata changes.
+# `replaced` are the refreshed ones whose stored ETag no longer matches:
+# the original itself changed, so its renditions are stale too.
+def diff_index(index, listing):
+    adds = [new_entry(f, meta) for f, meta in listing.items() if is_photo_key(f) and f not in index]
+    removals, refreshed, replaced = [], {}, []
+    for p in index:
+        meta = listing.get(p["filename"])
+        if meta is None:
+            removals.append(p["filename"])
+        elif (p.get("etag"), p.get("size"), p.get("last_modified")) != (meta["etag"], meta["size"], meta["last_modified"]):
+            refreshed[p["filename"]] = meta
+            if p.get("etag") and p["etag"] != meta["etag"]:
+                replaced.append(p["filename"])
+    return adds, removals, refreshed, replaced
+
+
+def batches(items, size=RECONCILE_BATCH):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# Each batch is its own transaction; a run that stops halfway leaves a
+# consistent index and the next run picks up the rest.
+def apply_diff(index, adds, removals, refreshed):
+    for batch in batches(adds):
+        with index.transaction():
+            for entry in batch:
+                index.add(entry)
+    index.remove_many(removals)
+    for batch in batches(refreshed.items()):
+        with index.transaction():
+            for filename, meta in batch:
+                index.update(filename, **meta)
+
+
+# --- RENDITIONS ---
+# Drops every cached rendition (all sizes and angles) of replaced originals
+# from the S3 cache and, when given, the local disk cache. Runs before the
+# new ETag is recorded, so nothing renders from the old bytes under the
+# new version. Returns the number of keys dropped.
+def invalidate_renditions(s3, filenames, disk_cache=None):
+    keys = [
+        rendition_key(filename, angle, width)
+        for filename in filenames for angle in RENDITION_ANGLES for width in RENDITION_SIZES.values()
+    ]
+    for batch in batches(keys, S3_DELETE_BATCH):
+        s3.delete_objects(Bucket=S3_BUCKET, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+    if disk_cache is not None:
+        for key in keys:
+            disk_cache.delete(key)
+    return len(keys)
+
+
+def reconcile(index, s3, dry_run=False, workers=RECONCILE_WORKERS, disk_cache=None):
+    start = time.perf_counter()
+    listing = list_originals(s3, workers=workers)
+    listed_at = time.perf_counter()
+    if not listing and len(index):
+        # Never wipe the index because of a bad prefix or an empty response
+        raise RuntimeError("S3 listing of originals came back empty")
+    adds, removals, refreshed, replaced = diff_index(index, listing)
+    if not dry_run:
+        invalidate_renditions(s3, replaced, disk_cache)
+        apply_diff(index, adds, removals, refreshed)
+    summary = {
+        "listed": len(listing),
+        "added": len(adds),
+        "removed": len(removals),
+        "refreshed": len(refreshed),
+        "replaced": len(replaced),
+        "list_seconds": round(listed_at - start, 2),
+        "total_seconds": round(time.perf_counter() - start, 2),
+        "dry_run": dry_run,
+    }
+    print(f"[RECONCILE] {summary}")
+    return summary
+
+
+# --- JOB ---
+# reconcile() under a BackgroundJob, for /photo-index/reconcile and the CLI;
+# the summary ends up in the job's progress file.
+def reconcile_job(job, index, s3, dry_run=False, workers=RECONCILE_WORKERS, disk_cache=None):
+    job.begin(0, dry_run=dry_run)
+    summary = reconcile(index, s3, dry_run=dry_run, workers=workers, disk_cache=disk_cache)
+    job.finish(total=summary["listed"], **summary)
+    return job.state
+
+
+# --- CLI ---
+# Works on the index database directly; running workers pick the result up
+# from the change log on their next request.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile the photo index with photos/originals/ in S3")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--workers", type=int, default=RECONCILE_WORKERS)
+    parser.add_argument("--db", default=PHOTO_INDEX_DB)
+    args = parser.parse_args()
+
+    index_db = IndexDB(args.db)
+    index_db.migrate_from_json()
+    index = PhotoIndex.from_store(index_db)
+    run_cli(
+        RECONCILE_JOB, reconcile_job, index, make_s3_client(),
+        dry_run=args.dry_run, workers=args.workers, disk_cache=DiskCache(),
+    )
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+JOBS_DIR = os.getenv("JOBS_DIR", "cache/jobs")
+
+
+# --- BACKGROUND JOB ---
+# Progress for a long-running job, written to cache/jobs/<name>.json so any
+# gunicorn worker (or the CLI) can report it. An flock on <name>.lock makes
+# sure only one copy of a job runs at a time across processes.
+class BackgroundJob:
+    def __init__(self, name, jobs_dir=JOBS_DIR):
+        self.name = name
+        self.jobs_dir = jobs_dir
+        self.state_path = os.path.join(jobs_dir, f"{name}.json")
+        self.lock_path = os.path.join(jobs_dir, f"{name}.lock")
+        self.lock_file = None
+        self.state = {}
+        self.last_write = 0
+        self.mutex = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    # --- LOCKING ---
+    def try_acquire(self):
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def release(self):
+        if self.lock_file:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def is_running(self):
+        if self.lock_file:
+            return True
+        with open(self.lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+
+    # --- PROGRESS ---
+    def begin(self, total, **extra):
+        now = time.time()
+        self.state = {
+            "job": self.name,
+            "status": "running",
+            "total": total,
+            "done": 0,
+            "failed": 0,
+            "started_at": now,
+            "updated_at": now,
+            "per_second": 0.0,
+            **extra,
+        }
+        self._write(force=True)
+
+    def advance(self, ok=True, **extra):
+        with self.mutex:
+            self.state["done" if ok else "failed"] += 1
+            self.state.update(extra)
+            self._write()
+
+    def finish(self, status="finished", **extra):
+        with self.mutex:
+            self.state["status"] = status
+            self.state.update(extra)
+            self._write(force=True)
+
+    def _write(self, force=False):
+        now = time.time()
+        if not force and now - self.last_write < 1.0:
+            return
+        self.last_write = now
+        elapsed = max(now - self.state.get("started_at", now), 1e-6)
+        self.state["updated_at"] = now
+        self.state["per_second"] = round((self.state.get("done", 0) + self.state.get("failed", 0)) / elapsed, 2)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.jobs_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def read(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"job": self.name, "status": "idle"}
+        if state.get("status") in ("starting", "running") and not self.is_running():
+            state["status"] = "interrupted"
+        return state
+
+    # Runs fn(job) in a daemon thread if no other process holds the job lock.
+    def start_in_thread(self, fn, *args, **kwargs):
+        if not self.try_acquire():
+            return False
+        self.state = {"job": self.name, "status": "starting", "started_at": time.time()}
+        self._write(force=True)
+
+        def run():
+            try:
+                fn(self, *args, **kwargs)
+            except Exception as e:
+                print(f"[JOB] {self.name} failed: {e}")
+                self.finish("failed", error=str(e))
+            finally:
+                self.release()
+
+        threading.Thread(target=run, name=f"job-{self.name}", daemon=True).start()
+        return True
+
+
+# --- RUNNERS ---
+# Runs task(*item) on `pool` for every item, with at most `depth` tasks
+# queued at a time so memory stays bounded however many items there are,
+# and records each outcome on the job. label(item) names an item in the
+# progress file and the log; on_done gets each task's result.
+def run_bounded(job, pool, task, items, depth, label=lambda item: item[0], on_done=None):
+    pending = {}
+    todo = iter(items)
+    while True:
+        while len(pending) < depth:
+            item = next(todo, None)
+            if item is None:
+                break
+            pending[pool.submit(task, *item)] = item
+        if not pending:
+            break
+
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            name = label(pending.pop(future))
+            try:
+                result = future.result()
+                if on_done:
+                    on_done(result)
+                job.advance(True, last=name)
+            except Exception as e:
+                print(f"[JOB] {job.name}: {name} failed: {e}")
+                job.advance(False, last_error=f"{name}: {e}")
+
+
+# Runs fn(job, ...) from the command line under the job's lock; exits if a
+# worker or another process is already running it. Returns fn's result.
+def run_cli(name, fn, *args, **kwargs):
+    job = BackgroundJob(name)
+    if not job.try_acquire():
+        print(f"❌ {name} is already running")
+        raise SystemExit(1)
+    try:
+        return fn(job, *args, **kwargs)
+    finally:
+        job.release()
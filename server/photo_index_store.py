@@ -0,0 +1,652 @@
+import os
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left, bisect_right
+
+
+# --- HELPERS ---
+def extract_year(photo):
+    try:
+        if photo.get("date"):
+            y = int(photo["date"][:4])
+            return None if y == 2100 else y
+        parts = photo["filename"].split("/")
+        for part in parts:
+            if part.isdigit():
+                y = int(part)
+                return y if 1900 <= y <= 2100 and y != 2100 else None
+    except:
+        return None
+
+
+def is_hidden_file(filename):
+    return os.path.basename(filename).startswith("._")
+
+
+# Range queries walk an array of sort keys ordered by (year, seq), packed
+# into one int so bisect compares plain ints. seq is the photo's insertion
+# order in the store, the same in every worker, so the key doubles as the
+# paging cursor: it stays valid while photos are added or deleted and
+# whichever worker answers the next page.
+SEQ_BITS = 32
+SEQ_MASK = (1 << SEQ_BITS) - 1
+
+def sort_key(year, seq):
+    return (year << SEQ_BITS) | seq
+
+def key_year(key):
+    return key >> SEQ_BITS
+
+
+# --- COLUMN CODECS ---
+# A value goes into a column only if it comes back out byte-identical;
+# anything else is kept as-is in the row's extras.
+def pack_date(value):
+    if isinstance(value, str) and len(value) == 10 and value[4] == "-" and value[7] == "-":
+        y, m, d = value[:4], value[5:7], value[8:]
+        if y.isdigit() and m.isdigit() and d.isdigit():
+            return int(y) * 10000 + int(m) * 100 + int(d)
+    return None
+
+def unpack_date(packed):
+    if not packed:
+        return None
+    text = _date_strings.get(packed)
+    if text is None:
+        text = _date_strings[packed] = f"{packed // 10000:04d}-{packed // 100 % 100:02d}-{packed % 100:02d}"
+    return text
+
+_date_strings = {}  # a library has a few thousand distinct days at most
+
+def pack_timestamp(value):
+    try:
+        ts = int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+    return ts if unpack_timestamp(ts) == value else None
+
+# Same text as datetime.fromtimestamp(ts, timezone.utc).isoformat(), built
+# from a per-day cache since it runs for every row of a full listing.
+def unpack_timestamp(ts):
+    days, seconds = divmod(ts, 86400)
+    day = _day_strings.get(days)
+    if day is None:
+        day = _day_strings[days] = (EPOCH + timedelta(days=days)).date().isoformat()
+    return f"{day}T{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}+00:00"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_day_strings = {}
+
+def pack_etag(value):
+    if isinstance(value, str) and len(value) == 32:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            return None
+    return None
+
+
+# Per-row flag bits
+FACES = 1
+DELETED = 2
+GONE = 4        # removed from the index; rows are never reused or moved
+HAS_ETAG = 8
+
+ETAG_BYTES = 16
+NONE = -1       # "no value" in the int columns
+MISSING = object()
+
+# Fields every entry has, in the order they are emitted
+ENTRY_FIELDS = ("filename", "date", "camera", "angle", "hasFaces", "gps", "location")
+SPARSE_FIELDS = ("camera", "gps", "location")
+
+
+# --- PHOTO INDEX ---
+# Columnar: one slot per row in typed arrays instead of one dict per photo.
+#   filename    interned directory (row_dirs) + utf-8 basename in one blob
+#   date        YYYYMMDD int32        year   int16
+#   angle       quarter turns, int8   flags  hasFaces/deleted/removed bits
+#   etag/size/last_modified (from reconcile) as 16 raw bytes / int64s
+# Values that don't fit a column (free-form angles, camera, gps, ...) live
+# in a sparse row -> dict of extras. Dicts are only built at the edges
+# (get(), live(), query results) and are copies: change entries through
+# the mutation methods.
+#
+# Lookups by filename bisect a sorted array of filename hashes; range
+# queries bisect the year-sorted layout (sort_keys / sorted_rows). With a
+# `store` (IndexDB) every mutation is written through to it first, so a
+# failed write leaves the in-memory index untouched, and sync() replays what
+# the other workers wrote.
+class PhotoIndex:
+    def __init__(self, entries=(), deleted=(), store=None):
+        self.lock = threading.RLock()
+        self.store = store
+        self.undo = None  # list of undo callbacks inside transaction()
+        self.synced = 0   # last change from the store's log applied here
+        # Bumped whenever positions in the sorted layout shift
+        self.layout_version = 0
+        # Bumped whenever any entry or the deleted set changes
+        self.version = 0
+        self._reset(deleted)
+        self._load(enumerate(entries))
+
+    # Loads from an IndexDB, remembering where its change log stood so
+    # sync() can replay everything committed after this point.
+    @classmethod
+    def from_store(cls, store):
+        index = cls(store=store)
+        index._reload()
+        return index
+
+    def _reset(self, deleted):
+        self.dirs = []
+        self.dir_ids = {}
+        self.row_dirs = array("I")
+        self.names = bytearray()
+        self.name_ends = array("I")
+        self.seqs = array("I")
+        self.years = array("h")
+        self.dates = array("i")
+        self.turns = array("b")
+        self.flags = bytearray()
+        self.etags = bytearray()
+        self.sizes = array("q")
+        self.modified = array("q")
+        self.extras = {}
+
+        self.hashes = array("q")
+        self.hash_rows = array("I")
+        self.sort_keys = array("q")
+        self.sorted_rows = array("I")
+        self.deleted = set(deleted)
+        self.length = 0
+        self.layout_version += 1
+        self.version += 1
+
+    # Bulk load of (seq, entry) pairs into an empty index
+    def _load(self, rows):
+        hashed, dated = [], []
+        seen = set()
+        for seq, entry in rows:
+            filename = entry["filename"]
+            if filename in seen or is_hidden_file(filename):
+                continue
+            seen.add(filename)
+            row = self._append(entry, seq)
+            hashed.append((hash(filename), row))
+            if self.years[row]:
+                dated.append((sort_key(self.years[row], seq), row))
+        del seen
+
+        hashed.sort()
+        self.hashes = array("q", (h for h, _ in hashed))
+        self.hash_rows = array("I", (row for _, row in hashed))
+        del hashed
+        dated.sort()
+        self.sort_keys = array("q", (key for key, _ in dated))
+        self.sorted_rows = array("I", (row for _, row in dated))
+
+        for filename in self.deleted:
+            row = self._row(filename)
+            if row is not None:
+                self.flags[row] |= DELETED
+
+    def __len__(self):
+        return self.length
+
+    # Takes the lock per row rather than across yields, so a long iteration
+    # doesn't hold up writers.
+    def __iter__(self):
+        row = 0
+        while True:
+            with self.lock:
+                if row >= len(self.flags):
+                    return
+                entry = None if self.flags[row] & GONE else self.entry(row)
+            if entry is not None:
+                yield entry
+            row += 1
+
+    def __contains__(self, filename):
+        with self.lock:
+            return self._row(filename) is not None
+
+    # --- ROWS ---
+    def _append(self, entry, seq):
+        row = len(self.flags)
+        directory, _, name = entry["filename"].rpartition("/")
+        dir_id = self.dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self.dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        self.row_dirs.append(dir_id)
+        self.names += name.encode("utf-8")
+        self.name_ends.append(len(self.names))
+        self.seqs.append(seq)
+        self.years.append(extract_year(entry) or 0)
+        self.dates.append(0)
+        self.turns.append(0)
+        self.flags.append(0)
+        self.etags += bytes(ETAG_BYTES)
+        self.sizes.append(NONE)
+        self.modified.append(NONE)
+        self._set_fields(row, {k: v for k, v in entry.items() if k != "filename"})
+        self.length += 1
+        return row
+
+    def filename(self, row):
+        start = self.name_ends[row - 1] if row else 0
+        name = self.names[start:self.name_ends[row]].decode("utf-8")
+        directory = self.dirs[self.row_dirs[row]]
+        return f"{directory}/{name}" if directory else name
+
+    def entry(self, row):
+        extra = self.extras.get(row)
+        flags = self.flags[row]
+        if extra is None:
+            entry = {
+                "filename": self.filename(row),
+                "date": unpack_date(self.dates[row]),
+                "camera": None,
+                "angle": self.turns[row] * 90,
+                "hasFaces": bool(flags & FACES),
+                "gps": None,
+                "location": None,
+            }
+        else:
+            entry = {
+                "filename": self.filename(row),
+                "date": extra["date"] if "date" in extra else unpack_date(self.dates[row]),
+                "camera": extra.get("camera"),
+                "angle": extra["angle"] if "angle" in extra else self.turns[row] * 90,
+                "hasFaces": extra["hasFaces"] if "hasFaces" in extra else bool(flags & FACES),
+                "gps": extra.get("gps"),
+                "location": extra.get("location"),
+            }
+        if flags & HAS_ETAG:
+            entry["etag"] = self.etags[row * ETAG_BYTES:(row + 1) * ETAG_BYTES].hex()
+        size = self.sizes[row]
+        if size != NONE:
+            entry["size"] = size
+        modified = self.modified[row]
+        if modified != NONE:
+            entry["last_modified"] = unpack_timestamp(modified)
+        if extra:
+            for key, value in extra.items():
+                entry.setdefault(key, value)
+        return entry
+
+    # Stores each field in its column when it round-trips, otherwise in the
+    # row's extras. MISSING removes a field.
+    def _set_fields(self, row, fields):
+        extra = self.extras.get(row) or {}
+        for key, value in fields.items():
+            extra.pop(key, None)
+            if key == "date":
+                packed = pack_date(value)
+                self.dates[row] = packed or 0
+                if packed is None and value not in (None, MISSING):
+                    extra[key] = value
+            elif key == "angle":
+                if isinstance(value, int) and value % 90 == 0:
+                    self.turns[row] = value % 360 // 90
+                else:
+                    self.turns[row] = 0
+                    if value is not MISSING:
+                        extra[key] = value
+            elif key == "hasFaces":
+                has_faces = value is not MISSING and bool(value)
+                self.flags[row] = (self.flags[row] | FACES) if has_faces else (self.flags[row] & ~FACES)
+                if not isinstance(value, bool) and value is not MISSING:
+                    extra[key] = value  # keep non-bool values exactly as given
+            elif key == "etag":
+                packed = pack_etag(value)
+                self.flags[row] = (self.flags[row] | HAS_ETAG) if packed else (self.flags[row] & ~HAS_ETAG)
+                if packed:
+                    self.etags[row * ETAG_BYTES:(row + 1) * ETAG_BYTES] = packed
+                elif value is not MISSING:
+                    extra[key] = value
+            elif key == "size":
+                fits = isinstance(value, int) and not isinstance(value, bool) and value >= 0
+                self.sizes[row] = value if fits else NONE
+                if not fits and value is not MISSING:
+                    extra[key] = value
+            elif key == "last_modified":
+                packed = pack_timestamp(value)
+                self.modified[row] = NONE if packed is None else packed
+                if packed is None and value is not MISSING:
+                    extra[key] = value
+            elif key in SPARSE_FIELDS:
+                if value is not None and value is not MISSING:
+                    extra[key] = value
+            elif value is not MISSING:
+                extra[key] = value
+        if extra:
+            self.extras[row] = extra
+        else:
+            self.extras.pop(row, None)
+
+    def _row(self, filename):
+        h = hash(filename)
+        i = bisect_left(self.hashes, h)
+        while i < len(self.hashes) and self.hashes[i] == h:
+            row = self.hash_rows[i]
+            if self.filename(row) == filename:
+                return row
+            i += 1
+        return None
+
+    def _place(self, row):
+        if self.years[row]:
+            key = sort_key(self.years[row], self.seqs[row])
+            pos = bisect_left(self.sort_keys, key)
+            self.sort_keys.insert(pos, key)
+            self.sorted_rows.insert(pos, row)
+            self.layout_version += 1
+
+    def _unplace(self, row):
+        if self.years[row]:
+            pos = bisect_left(self.sort_keys, sort_key(self.years[row], self.seqs[row]))
+            del self.sort_keys[pos]
+            del self.sorted_rows[pos]
+            self.layout_version += 1
+
+    # --- LOOKUPS ---
+    # Mutations update the parallel arrays (hashes/hash_rows, sort_keys/
+    # sorted_rows, the columns) in several steps, so every read takes the
+    # lock too; a reader between two of those steps would miss rows.
+    def get(self, filename):
+        with self.lock:
+            row = self._row(filename)
+            return None if row is None else self.entry(row)
+
+    def is_deleted(self, filename):
+        with self.lock:
+            return filename in self.deleted
+
+    def live(self):
+        with self.lock:
+            flags = self.flags
+            return [self.entry(row) for row in range(len(flags)) if not flags[row] & (DELETED | GONE)]
+
+    def year_bounds(self):
+        with self.lock:
+            if not self.sort_keys:
+                return None
+            return key_year(self.sort_keys[0]), key_year(self.sort_keys[-1])
+
+    def year_slice(self, start_year, end_year):
+        with self.lock:
+            lo = bisect_left(self.sort_keys, sort_key(start_year, 0))
+            hi = bisect_left(self.sort_keys, sort_key(end_year + 1, 0))
+            return lo, hi
+
+    # Returns (entries, next_cursor). next_cursor is None once the range is
+    # exhausted; pass it back as `cursor` to continue after the last entry.
+    def query_range(self, start_year, end_year, cursor=None, limit=None, include_deleted=False):
+        with self.lock:
+            return self._query_range(start_year, end_year, cursor, limit, include_deleted)
+
+    def _query_range(self, start_year, end_year, cursor, limit, include_deleted):
+        lo, hi = self.year_slice(start_year, end_year)
+        if cursor is not None:
+            lo = max(lo, bisect_right(self.sort_keys, cursor))
+
+        flags, rows = self.flags, self.sorted_rows
+        skip = 0 if include_deleted else DELETED
+        result = []
+        pos = lo
+        while pos < hi:
+            if limit is not None and len(result) >= limit:
+                break
+            row = rows[pos]
+            if not flags[row] & skip:
+                result.append(self.entry(row))
+            pos += 1
+
+        next_cursor = self.sort_keys[pos - 1] if pos < hi and pos > lo else None
+        return result, next_cursor
+
+    def in_year_range(self, start_year, end_year, include_deleted=False):
+        return self.query_range(start_year, end_year, include_deleted=include_deleted)[0]
+
+    # --- MUTATIONS ---
+    # Groups several mutations into one store transaction. It is all or
+    # nothing: if the block raises, the store rolls back and every in-memory
+    # change made inside it is undone (newest first) from the undo log.
+    # The store's write lock is taken before self.lock, so while another
+    # process holds it this thread waits without holding up the worker's
+    # readers; the other workers' changes are then replayed under both, so
+    # mutations always start from the latest state.
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            nested = self.undo is not None  # only ever set by the lock's owner
+        if nested:
+            with self.lock:
+                yield self  # the outermost block owns commit/rollback
+            return
+
+        undo = []
+        written = None
+        try:
+            with self.store.transaction() if self.store is not None else nullcontext():
+                with self.lock:
+                    self.undo = undo
+                    try:
+                        if self.store is not None:
+                            self._sync()
+                        yield self
+                        if self.store is not None and undo:
+                            written = self.store.last_change()
+                    finally:
+                        self.undo = None
+        except BaseException:
+            with self.lock:
+                for step in reversed(undo):
+                    step()
+            raise
+        finally:
+            if undo:
+                with self.lock:
+                    self.version += 1
+        if written is not None:
+            with self.lock:
+                self.synced = max(self.synced, written)  # this copy already holds them
+
+    # Read-only counterpart of transaction(): holds the lock over a read
+    # transaction on the store, with this copy synced to it, so what is read
+    # from both agrees. Readers never wait on the store's writers.
+    @contextmanager
+    def snapshot(self):
+        if self.store is None:
+            with self.lock:
+                yield self
+            return
+        with self.store.snapshot(), self.lock:
+            self._sync()
+            yield self
+
+    def _on_rollback(self, undo):
+        if self.undo is not None:
+            self.undo.append(undo)
+
+    def add(self, entry):
+        with self.transaction():
+            filename = entry["filename"]
+            if is_hidden_file(filename):
+                return None
+            existing = self._row(filename)
+            if existing is not None:
+                return self.entry(existing)
+            seq = self.store.insert(entry) if self.store else len(self.flags)
+            row = self._insert(entry, seq)
+            self._on_rollback(lambda: self._drop([row]))
+            return self.entry(row)
+
+    def _insert(self, entry, seq):
+        row = self._append(entry, seq)
+        h = hash(entry["filename"])
+        i = bisect_right(self.hashes, h)
+        self.hashes.insert(i, h)
+        self.hash_rows.insert(i, row)
+        self._place(row)
+        if entry["filename"] in self.deleted:
+            self.flags[row] |= DELETED
+        return row
+
+    def rotate(self, filename, step=90):
+        with self.transaction():
+            row = self._row(filename)
+            if row is None:
+                return None
+            entry = self.entry(row)
+            old_angle = entry["angle"]
+            angle = (old_angle + step) % 360
+            if self.store:
+                self.store.save({**entry, "angle": angle})
+            self._set_fields(row, {"angle": angle})
+            self._on_rollback(lambda: self._set_fields(row, {"angle": old_angle}))
+            return angle
+
+    def delete(self, filename):
+        with self.transaction():
+            if filename in self.deleted:
+                return False
+            if self.store:
+                self.store.mark_deleted(filename)
+            row = self._mark_deleted(filename)
+
+            def undo():
+                self.deleted.discard(filename)
+                if row is not None:
+                    self.flags[row] &= ~DELETED
+            self._on_rollback(undo)
+            return True
+
+    def _mark_deleted(self, filename):
+        self.deleted.add(filename)
+        row = self._row(filename)
+        if row is not None:
+            self.flags[row] |= DELETED
+        return row
+
+    # Hard removal (object gone from S3), batched so the lookup arrays and
+    # the sorted layout are each rebuilt in a single pass.
+    def remove_many(self, filenames):
+        with self.transaction():
+            doomed = {f: self._row(f) for f in filenames}
+            doomed = {f: row for f, row in doomed.items() if row is not None}
+            if not doomed:
+                return 0
+            if self.store:
+                self.store.remove_many(doomed)
+            # _drop() builds new arrays, so the old ones are the snapshot
+            arrays = (self.hashes, self.hash_rows, self.sort_keys, self.sorted_rows)
+            was_deleted = set(doomed) & self.deleted
+            self._on_rollback(lambda: self._restore(arrays, doomed.values(), was_deleted))
+            self.deleted.difference_update(doomed)
+            self._drop(doomed.values())
+            return len(doomed)
+
+    def _drop(self, rows):
+        rows = set(rows)
+        for row in rows:
+            self.flags[row] |= GONE
+            self.length -= 1
+        kept = [(h, row) for h, row in zip(self.hashes, self.hash_rows) if row not in rows]
+        self.hashes = array("q", (h for h, _ in kept))
+        self.hash_rows = array("I", (row for _, row in kept))
+        kept = [(key, row) for key, row in zip(self.sort_keys, self.sorted_rows) if row not in rows]
+        self.sort_keys = array("q", (key for key, _ in kept))
+        self.sorted_rows = array("I", (row for _, row in kept))
+        self.layout_version += 1
+
+    def _restore(self, arrays, rows, was_deleted):
+        self.hashes, self.hash_rows, self.sort_keys, self.sorted_rows = arrays
+        for row in rows:
+            self.flags[row] &= ~GONE
+            self.length += 1
+        self.deleted.update(was_deleted)
+        self.layout_version += 1
+
+    def update(self, filename, **fields):
+        with self.transaction():
+            row = self._row(filename)
+            if row is None:
+                return None
+            entry = self.entry(row)
+            if self.store:
+                self.store.save({**entry, **fields})
+            old = {key: entry.get(key, MISSING) for key in fields}
+            self._set_fields(row, fields)
+            self._relocate(row)
+
+            def undo():
+                self._set_fields(row, old)
+                self._relocate(row)
+            self._on_rollback(undo)
+            return self.entry(row)
+
+    # Moves a row in the sorted layout if an update changed its year.
+    def _relocate(self, row):
+        year = extract_year(self.entry(row)) or 0
+        if year != self.years[row]:
+            self._unplace(row)
+            self.years[row] = year
+            self._place(row)
+
+    # --- SYNC ---
+    # Every worker holds its own copy of the index. Each store write also
+    # appends to the store's change log, and sync() replays whatever the
+    # other workers committed since this copy last looked (a single pragma
+    # when nothing changed, so it runs before every request). Replaying is
+    # idempotent, so this worker's own changes coming back around are no-ops.
+    def sync(self):
+        if self.store is not None and self.store.poll():
+            with self.lock:
+                self._sync()
+
+    def _sync(self):
+        changes = self.store.changes_since(self.synced)
+        if changes is None:
+            print("[INDEX] Change log no longer reaches back this far, reloading")
+            self._reload()
+            return
+        removed = []
+        for seq, op, filename, photo, entry in changes:
+            if removed and op != "remove":
+                self._drop(removed)  # before an add can bring the name back
+                removed = []
+            if op == "add":
+                if self._row(filename) is None:
+                    self._insert(entry, photo)
+            elif op == "save":
+                row = self._row(filename)
+                if row is not None:
+                    fields = {key: MISSING for key in self.entry(row)}
+                    fields.update(entry)
+                    del fields["filename"]
+                    self._set_fields(row, fields)
+                    self._relocate(row)
+            elif op == "delete":
+                self._mark_deleted(filename)
+            elif op == "remove":
+                self.deleted.discard(filename)
+                row = self._row(filename)
+                if row is not None and row not in removed:
+                    removed.append(row)
+            self.synced = seq
+        if removed:
+            self._drop(removed)
+        if changes:
+            self.version += 1
+
+    def _reload(self):
+        synced = self.store.last_change()
+        rows, deleted = self.store.load()
+        self._reset(deleted)
+        self._load(rows)
+        self.synced = synced
@@ -0,0 +1,163 @@
+import os
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from photo_index_store import FACES, DELETED, GONE
+
+MAX_DECKS = 64
+FEISTEL_ROUNDS = 4
+# Seconds a deal waits for the database write lock to save its deck
+DECK_SAVE_TIMEOUT = float(os.getenv("DECK_SAVE_TIMEOUT", "1"))
+DECK_SAVE_ATTEMPTS = 3
+
+
+# --- PERMUTATION ---
+# A keyed Feistel network over the smallest even power of two >= n, with
+# cycle walking to stay inside [0, n). It maps a draw number to a position
+# in O(1) without materializing a shuffled list, so a deck only needs its
+# seed and cursor.
+def _round(value, seed, rnd):
+    x = (value ^ seed ^ (rnd * 0x9E3779B1)) & 0xFFFFFFFF
+    x = (x * 0x85EBCA6B) & 0xFFFFFFFF
+    x ^= x >> 13
+    x = (x * 0xC2B2AE35) & 0xFFFFFFFF
+    x ^= x >> 16
+    return x
+
+
+def permute(i, n, seed):
+    bits = max(2, (n - 1).bit_length())
+    bits += bits % 2
+    half = bits // 2
+    mask = (1 << half) - 1
+    x = i
+    while True:
+        left, right = x >> half, x & mask
+        for rnd in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ (_round(right, seed, rnd) & mask)
+        x = (left << half) | right
+        if x < n:
+            return x
+
+
+# --- DECK ---
+class ShuffledDeck:
+    __slots__ = ("lo", "hi", "layout_version", "seed", "cursor")
+
+    def __init__(self, lo, hi, layout_version, seed=None, cursor=0):
+        self.lo = lo
+        self.hi = hi
+        self.layout_version = layout_version
+        if seed is None:
+            self.reset()
+        else:
+            self.seed, self.cursor = seed, cursor
+
+    def reset(self):
+        self.seed = random.getrandbits(32)
+        self.cursor = 0
+
+    def remaining(self):
+        return (self.hi - self.lo) - self.cursor
+
+    # Walks the permutation from the cursor, skipping positions the predicate
+    # rejects (deleted photos, no faces). Deleted photos simply never come
+    # out, so deletes don't force a reshuffle.
+    def deal(self, size, accept):
+        n = self.hi - self.lo
+        dealt = []
+        while len(dealt) < size and self.cursor < n:
+            pos = self.lo + permute(self.cursor, n, self.seed)
+            self.cursor += 1
+            if accept(pos):
+                dealt.append(pos)
+        return dealt
+
+
+# --- SAMPLER ---
+# One deck per from/to/hasFaces key, kept in a small LRU so the state stays
+# bounded no matter how many ranges the frontend asks for. A deck is rebuilt
+# when photos are added (positions in the sorted layout shift).
+#
+# When the index has a store, decks live in it instead of in this process:
+# every worker sees the same layout once synced, so a deck is just its
+# seed and cursor. A deal reads the deck from a snapshot and writes the
+# advanced one back with a compare-and-swap, retrying when another worker
+# moved it in between, so "no repeats" holds whichever worker answers.
+# Nothing waits long on the write lock: if it is busy past
+# DECK_SAVE_TIMEOUT the chunk is still returned, the deck just isn't
+# advanced (the next deal may repeat some of it).
+class PhotoSampler:
+    def __init__(self, index, max_decks=MAX_DECKS):
+        self.index = index
+        self.store = index.store
+        self.max_decks = max_decks
+        self.decks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _local_deck(self, key, lo, hi):
+        deck = self.decks.get(key)
+        if deck is None or deck.layout_version != self.index.layout_version:
+            deck = ShuffledDeck(lo, hi, self.index.layout_version)
+            self.decks[key] = deck
+        self.decks.move_to_end(key)
+        while len(self.decks) > self.max_decks:
+            self.decks.popitem(last=False)
+        return deck
+
+    # Returns (entries, deck); call with the index lock held.
+    def _deal(self, deck, size, require_faces, clear):
+        index = self.index
+        # Filters read the flag column only; dicts are built for the winners
+        skip = DELETED | GONE
+        want = FACES if require_faces else 0
+        flags, rows = index.flags, index.sorted_rows
+
+        def accept(pos):
+            row_flags = flags[rows[pos]]
+            return not row_flags & skip and row_flags & want == want
+
+        if clear or deck.remaining() <= 0:
+            deck.reset()
+        dealt = deck.deal(size, accept)
+        return [index.entry(rows[pos]) for pos in dealt]
+
+    def deal(self, start_year, end_year, size, require_faces=False, clear=False):
+        key = f"{start_year}-{end_year}-{require_faces}"
+        if self.store is None:
+            with self.index.lock, self.lock:
+                lo, hi = self.index.year_slice(start_year, end_year)
+                return self._deal(self._local_deck(key, lo, hi), size, require_faces, clear)
+
+        for _ in range(DECK_SAVE_ATTEMPTS):
+            with self.index.snapshot():
+                layout = self.store.layout_version()
+                saved = self.store.load_deck(key)
+                lo, hi = self.index.year_slice(start_year, end_year)
+                if saved is not None and saved[:3] == (lo, hi, layout):
+                    deck = ShuffledDeck(lo, hi, layout, seed=saved[3], cursor=saved[4])
+                else:
+                    deck = ShuffledDeck(lo, hi, layout)
+                entries = self._deal(deck, size, require_faces, clear)
+
+            state = (deck.lo, deck.hi, deck.layout_version, deck.seed, deck.cursor)
+            if state == saved:
+                return entries  # nothing was drawn
+            try:
+                if self.store.swap_deck(key, saved, state, self.max_decks, timeout=DECK_SAVE_TIMEOUT):
+                    return entries
+            except sqlite3.OperationalError as e:
+                print(f"[SAMPLER] Deck {key} not saved: {e}")
+                return entries
+        print(f"[SAMPLER] Deck {key} kept moving under us, not saved")
+        return entries
+
+    # The store is cleared first, without self.lock: deals must not queue up
+    # behind a wait for the write lock.
+    def clear(self):
+        if self.store is not None:
+            self.store.clear_decks()
+        with self.lock:
+            self.decks.clear()
@@ -1,53 +1,78 @@
-from flask import Flask, jsonify, abort, request, send_file, send_from_directory
-import os, io, json, random, time
-from collections import defaultdict
+from flask import Flask, Response, jsonify, abort, request, send_file, send_from_directory
+import os, io, json, time
 from werkzeug.utils import secure_filename
 from PIL import Image, ExifTags
-import boto3
 from botocore.exceptions import ClientError
 from flask_cors import CORS
 from dotenv import load_dotenv
 from io import BytesIO
 from datetime import datetime
 from functools import wraps
+from itertools import islice
 import pillow_heif
-import subprocess
-import tempfile
-import uuid
+from photo_index_store import PhotoIndex
+from index_db import IndexDB
+from photo_sampler import PhotoSampler
+from thumbnail_cache import DiskCache
+from s3_client import make_s3_client
+from s3_stream import VIDEO_RANGE_WINDOW, stream_s3_object
+from renditions import (
+    S3_ORIGINALS_PREFIX, RENDITION_SIZES,
+    rendition_key, rendition_version, parse_rendition_width, rotated_width,
+)
+from jobs import BackgroundJob
+from thumbnail_jobs import PREGENERATE_JOB, pregenerate_thumbnails
+from index_reconcile import RECONCILE_JOB, reconcile_job
+from image_pool import ImagePool, PoolBusy, PoolTimeout, IMAGE_POOL_RETRY_AFTER
+from response_compression import EncodedPayload, PayloadCache, compress_response
+from video_thumbnails import (
+    S3_VIDEO_THUMB_PREFIX,
+    video_key, poster_key, cache_mimetype, video_mimetype, video_thumbnail,
+)
+from video_jobs import VIDEO_THUMB_JOB, generate_video_thumbnails
+from video_index import VIDEO_INDEX_JOB, VIDEO_SORT_FIELDS, VideoIndex, refresh_video_index, refresh_if_stale
+from video_hls import S3_HLS_PREFIX, HLS_JOB, hls_mimetype, hls_job, hls_ready, transcode_on_demand, generate_hls
 
 pillow_heif.register_heif_opener()
 
 load_dotenv()
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Index-Version"])
 
 # --- S3 CONFIGURATION ---
-s3 = boto3.client("s3")
+# One client shared by every request thread and background job (see s3_client.py)
+s3 = make_s3_client()
 S3_BUCKET = "photo-video-repository"
-S3_ORIGINALS_PREFIX = "photos/originals"
-S3_CACHE_PREFIX_ROTATED = "cache-image/600px/rotated"
-S3_CACHE_PREFIX_UNROTATED = "cache-image/600px/unrotated"
 
-# --- IN-MEMORY INDEX ---
-photo_index = []
-deleted_photos = set()
-used_indices_by_range = defaultdict(set)
+# Bump when video thumbnail generation changes so clients drop old copies
+VIDEO_THUMB_VERSION = "1"
+
+# --- LOCAL THUMBNAIL CACHE (in front of the S3 cache prefixes) ---
+thumb_cache = DiskCache()
+thumb_cache.trim()
+
+# --- IMAGE PROCESS POOL (CPU-bound decode/resize/encode) ---
+image_pool = ImagePool()
 
 # --- LOAD INDEX + DELETED PHOTOS ---
-def load_filtered_index():
-    try:
-        with open("cache/photo_index.json", "r") as f:
-            index = json.load(f)
-            return [p for p in index if not os.path.basename(p["filename"]).startswith("._")]
-    except:
-        return []
-photo_index = load_filtered_index()
-
-try:
-    with open("cache/deleted_photos.json", "r") as f:
-        deleted_photos = set(json.load(f))
-except:
-    deleted_photos = set()
+# SQLite holds the durable copy; the first start imports the old JSON files.
+index_db = IndexDB()
+index_db.migrate_from_json("cache/photo_index.json", "cache/deleted_photos.json", "cache/photo_index.journal")
+
+# --- IN-MEMORY INDEX ---
+# One copy per worker, kept in step through the database's change log
+photo_index = PhotoIndex.from_store(index_db)
+photo_sampler = PhotoSampler(photo_index)
+
+# Videos (with ffprobe metadata) live in the same database
+video_index = VideoIndex(index_db)
+
+@app.before_request
+def sync_photo_index():
+    photo_index.sync()
+
+# JSON responses are compressed when the client accepts gzip/br/zstd
+app.after_request(compress_response)
 
 # --- TIMING DECORATOR ---
 def log_timing(route_name):
@@ -62,113 +87,316 @@ def log_timing(route_name):
         return wrapper
     return decorator
 
-# --- HELPERS ---
-def extract_year(photo):
+# --- RENDITIONS ---
+# Renditions are immutable per key (see renditions.rendition_key) and per
+# version of the original, so the ETag comes straight from the key and the
+# original's ETag, and If-None-Match is answered without touching disk or S3.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+def rendition_etag(cache_key, source_etag=None):
+    return thumb_cache.digest(f"{cache_key}#{source_etag}" if source_etag else cache_key)[:20]
+
+# The URL is immutable only when it names the current version (?v=...);
+# unversioned or stale URLs must revalidate.
+def rendition_cache_control(version):
+    return IMMUTABLE_CACHE_CONTROL if request.args.get("v") == str(version) else REVALIDATE_CACHE_CONTROL
+
+def pool_unavailable(reason):
+    response = jsonify({"error": reason})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(IMAGE_POOL_RETRY_AFTER)
+    return response
+
+# Renders on the image pool; a full queue or a stuck render turns into a
+# fast 503 + Retry-After instead of tying up the request thread.
+def render_on_pool(data, angle, widths):
     try:
-        if photo.get("date"):
-            y = int(photo["date"][:4])
-            return None if y == 2100 else y
-        parts = photo["filename"].split("/")
-        for part in parts:
-            if part.isdigit():
-                y = int(part)
-                return y if 1900 <= y <= 2100 and y != 2100 else None
-    except:
+        return image_pool.render_thumbnails(data, angle, widths)
+    except PoolBusy:
+        print("[POOL] Queue full, rejecting render")
+        return abort(pool_unavailable("Image renderer busy"))
+    except PoolTimeout:
+        print("[POOL] Render timed out")
+        return abort(pool_unavailable("Image render timed out"))
+
+def not_modified(etag, cache_control):
+    if not request.if_none_match.contains_weak(etag):
         return None
-
-def filter_photos_by_year_range(start_year, end_year):
-    return [p for p in photo_index if (y := extract_year(p)) and start_year <= y <= end_year]
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+def send_rendition(path, etag, mimetype, cache_control):
+    response = send_file(path, mimetype=mimetype, etag=False, conditional=False)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.expires = None
+    return response
 
 # --- ROUTES ---
 
-@app.route("/serve-image/<path:filename>")
-@log_timing("serve-image")
-def serve_image(filename):
-    image_entry = next((x for x in photo_index if x['filename'] == filename), None)
-    if not image_entry:
-        print(f"[404] Not in photo_index: {filename}")
-        return abort(404)
-
-    angle = image_entry.get("angle", 0)
-    is_rotated = angle != 0
+# Fills the disk cache for one rendition from the S3 cache, or renders it
+# from the original. When rendering, the other sizes of the same photo that
+# exist neither on local disk nor in the S3 cache are produced from the same
+# download and decode; sizes that already exist are not re-encoded or
+# uploaded again.
+# Runs inside thumb_cache.single_flight() for the photo.
+def fill_thumbnail_cache(filename, angle, width):
+    cache_key = rendition_key(filename, angle, width)
     original_key = f"{S3_ORIGINALS_PREFIX}/{filename}"
-    cache_key = f"{S3_CACHE_PREFIX_ROTATED if is_rotated else S3_CACHE_PREFIX_UNROTATED}/{filename}.webp"
 
     # 1. Try S3 cache
     try:
         cached = s3.get_object(Bucket=S3_BUCKET, Key=cache_key)
-        return send_file(BytesIO(cached["Body"].read()), mimetype="image/webp")
+        return thumb_cache.put(cache_key, cached["Body"].read())
     except ClientError as e:
         if e.response["Error"]["Code"] != "NoSuchKey":
             print(f"[S3 ERROR] Failed to fetch cache {cache_key}:", e)
             return abort(500)
 
-    # 2. Fetch original from S3
+    # 2. Rotated: turn an unrotated rendition that is big enough
+    if angle:
+        source = find_rotation_source(filename, angle, width)
+        if source:
+            data, limit = source
+            rendered = render_on_pool(data, angle, missing_widths(filename, angle, width, limit))
+            return store_renditions(filename, angle, rendered, cache_key)
+
+    # 3. Fetch original from S3
     try:
         original_obj = s3.get_object(Bucket=S3_BUCKET, Key=original_key)
-        img = Image.open(BytesIO(original_obj["Body"].read()))
-        img = img.convert("RGB")  # Ensure compatibility for all formats
+        original_data = original_obj["Body"].read()
     except Exception as e:
         print(f"[ERROR] Could not open original image {original_key}: {e}")
         return abort(404)
 
-    # 3. Apply rotation and resize
-    try:
-        if angle:
-            img = img.rotate(-angle, expand=True)
-
-        width = 600
-        ratio = width / float(img.size[0])
-        height = int((float(img.size[1]) * float(ratio)))
-        img = img.resize((width, height), Image.LANCZOS)
-
-        # Save to memory
-        buffer = BytesIO()
-        img.save(buffer, format="WEBP")
-        buffer.seek(0)
+    # 4. Apply rotation and resize for this and any other missing sizes
+    rendered = render_on_pool(original_data, angle, missing_widths(filename, angle, width))
+    return store_renditions(filename, angle, rendered, cache_key)
+
+# The requested width plus every other size that is neither on local disk
+# nor in the S3 cache, up to `limit` (the widest the source can give without
+# upscaling). render_thumbnails decodes for the widest of these, so a miss
+# for a small size whose large rendition exists decodes small.
+def missing_widths(filename, angle, width, limit=None):
+    return [width] + [
+        w for w in RENDITION_SIZES.values()
+        if w != width and (limit is None or w <= limit)
+        and not rendition_exists(rendition_key(filename, angle, w))
+    ]
 
+def rendition_exists(key):
+    if thumb_cache.get(key):
+        return True
+    try:
+        s3.head_object(Bucket=S3_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            print(f"[S3 ERROR] Failed to check cache {key}:", e)
+        return False  # when in doubt, render it
+
+# Smallest unrotated rendition (local disk first, then the S3 cache) that
+# still covers `width` once turned. Returns (bytes, rotated width) or None.
+def find_rotation_source(filename, angle, width):
+    keys = [rendition_key(filename, 0, w) for w in sorted(RENDITION_SIZES.values())]
+    remote = []
+    for key in keys:
+        path = thumb_cache.get(key)
+        try:
+            if not path:
+                raise FileNotFoundError(key)
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            remote.append(key)  # not local (or evicted): try the S3 copy
+            continue
+        limit = rotated_width(data, angle)
+        if limit >= width:
+            return data, limit
+    for key in remote:
+        try:
+            data = s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+        except ClientError:
+            continue
+        thumb_cache.put(key, data)
+        limit = rotated_width(data, angle)
+        if limit >= width:
+            return data, limit
+    return None
+
+def store_renditions(filename, angle, rendered, cache_key):
+    try:
         # Save to S3 cache
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=cache_key,
-            Body=buffer.getvalue(),
-            ContentType="image/webp"
-        )
-        buffer.seek(0)
-        return send_file(buffer, mimetype="image/webp")
+        for w, data in rendered.items():
+            key = rendition_key(filename, angle, w)
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=key,
+                Body=data,
+                ContentType="image/webp"
+            )
+            thumb_cache.put(key, data)
+        return thumb_cache.path_for(cache_key)
 
     except Exception as e:
         print(f"[ERROR] Failed to process image {filename}: {e}")
         return abort(500)
 
+@app.route("/serve-image/<path:filename>")
+@log_timing("serve-image")
+def serve_image(filename):
+    image_entry = photo_index.get(filename)
+    if not image_entry:
+        print(f"[404] Not in photo_index: {filename}")
+        return abort(404)
+
+    width = parse_rendition_width(request.args.get("size"))
+    if width is None:
+        return jsonify({"error": f"Unknown size, use one of {sorted(RENDITION_SIZES)}"}), 400
+
+    angle = image_entry.get("angle", 0)
+    cache_key = rendition_key(filename, angle, width)
+    etag = rendition_etag(cache_key, image_entry.get("etag"))
+    cache_control = rendition_cache_control(rendition_version(image_entry))
+
+    # Repeat views: the browser or proxy already has these exact bytes
+    unchanged = not_modified(etag, cache_control)
+    if unchanged:
+        return unchanged
+
+    # Local disk cache first; on a miss only one request per photo (across
+    # threads and workers) goes to S3 or renders, the rest wait and then
+    # find the file on disk.
+    cached_path = thumb_cache.get(cache_key)
+    if not cached_path:
+        with thumb_cache.single_flight(f"render:{filename}:{angle}"):
+            cached_path = thumb_cache.get(cache_key) or fill_thumbnail_cache(filename, angle, width)
+
+    try:
+        return send_rendition(cached_path, etag, "image/webp", cache_control)
+    except FileNotFoundError:
+        print(f"[CACHE] Evicted before send: {cache_key}")
+        return abort(503)
+
+# Serialized and compressed once per index version, then sent as is; the
+# ETag lets Photos.tsx revalidate on mount with a 304. X-Index-Version is
+# the change log position the snapshot includes, to pass as ?since= to
+# /photo-index/changes later.
+full_index_payload = PayloadCache()
+
+def encode_full_index():
+    with photo_index.lock:
+        entries = photo_index.live()
+        version = photo_index.synced
+    return EncodedPayload(app.json.dumps(entries).encode("utf-8"), headers={"X-Index-Version": str(version)})
+
 @app.route("/photo-index/full")
 def get_photo_index():
-    return jsonify([p for p in photo_index if p["filename"] not in deleted_photos])
+    return full_index_payload.get(photo_index.version, encode_full_index).response(REVALIDATE_CACHE_CONTROL)
+
+# --- DELTA SYNC ---
+# Changes after ?since=<version> from the shared change log, oldest first:
+#   {"op": "add" | "save", "filename": ..., "entry": {...}}  upsert the entry
+#   {"op": "delete", "filename": ...}                        mark as deleted
+#   {"op": "remove", "filename": ...}                        gone from S3: drop it
+# `version` is what to send next time; `more` means call again right away.
+# When the log has been compacted past `since` the answer is {"resync": true}
+# and the client reloads /photo-index/full.
+MAX_CHANGES_PER_RESPONSE = 5000
+
+def client_changes(changes):
+    # Only the last upsert/removal of a file matters; earlier saves are dropped
+    latest = {}
+    for i, (seq, op, filename, photo, entry) in enumerate(changes):
+        if op != "delete":
+            latest[filename] = i
+    delta = []
+    for i, (seq, op, filename, photo, entry) in enumerate(changes):
+        if op in ("add", "save") and latest[filename] != i:
+            continue
+        change = {"op": op, "filename": filename}
+        if entry is not None:
+            change["entry"] = entry
+        delta.append(change)
+    return delta
+
+@app.route("/photo-index/changes")
+@log_timing("photo-index/changes")
+def get_photo_index_changes():
+    try:
+        since = int(request.args["since"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "since must be a version from /photo-index/full or a previous call"}), 400
+
+    latest = index_db.last_change()
+    changes = index_db.changes_since(since, MAX_CHANGES_PER_RESPONSE) if 0 <= since <= latest else None
+    if changes is None:
+        return jsonify({"resync": True, "version": latest})
+
+    version = changes[-1][0] if changes else since
+    return jsonify({"version": version, "changes": client_changes(changes), "more": version < latest})
 
 @app.route("/photo-index/sample")
 def sample_index():
-    return jsonify(photo_index[:3])
+    return jsonify(list(islice(photo_index, 3)))
 
 @app.route("/photo-index/range")
 @log_timing("photo-index/range")
 def get_photos_by_year_range():
     start = int(request.args.get("from", 1900))
     end = int(request.args.get("to", 2100))
-    filtered = [
-        p for p in photo_index
-        if (y := extract_year(p)) and start <= y <= end and p["filename"] not in deleted_photos
-    ]
-    return jsonify(filtered)
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+
+    # Without a limit, keep returning the plain list the frontend expects
+    if limit is None:
+        return jsonify(photo_index.in_year_range(start, end))
+
+    photos, next_cursor = photo_index.query_range(
+        start, end,
+        cursor=int(cursor) if cursor else None,
+        limit=max(1, min(int(limit), 5000)),
+    )
+    return jsonify({"photos": photos, "nextCursor": str(next_cursor) if next_cursor is not None else None})
 
 @app.route("/photo-index/range-of-years")
 @log_timing("photo-index/range-of-years")
 def get_photo_year_range():
-    years = [extract_year(p) for p in photo_index if extract_year(p)]
-    return jsonify({"min": min(years), "max": max(years)}) if years else jsonify({"min": 2003, "max": 2025})
+    bounds = photo_index.year_bounds()
+    return jsonify({"min": bounds[0], "max": bounds[1]}) if bounds else jsonify({"min": 2003, "max": 2025})
 
-@app.route("/photo-index/rebuild")
+# Starts the thumbnail pre-generation job (see thumbnail_jobs.py); the same
+# job can be run from the CLI with `python thumbnail_jobs.py`.
+@app.route("/photo-index/rebuild", methods=["GET", "POST"])
 def rebuild():
-    return jsonify({"status": "rebuild not implemented"})
+    job = BackgroundJob(PREGENERATE_JOB)
+    entries = [{"filename": p["filename"], "angle": p.get("angle", 0)} for p in photo_index.live()]
+    if job.start_in_thread(pregenerate_thumbnails, entries):
+        return jsonify({"status": "started", "entries": len(entries)}), 202
+    return jsonify({"status": "running", "progress": job.read()}), 409
+
+@app.route("/photo-index/rebuild/status")
+def rebuild_status():
+    return jsonify(BackgroundJob(PREGENERATE_JOB).read())
+
+# Picks up photos uploaded outside /photo-index/add and drops entries whose
+# originals are gone, as a background job (see index_reconcile.py); the
+# summary shows up in /photo-index/reconcile/status. ?dryRun=true only
+# reports the diff.
+@app.route("/photo-index/reconcile", methods=["POST"])
+def reconcile_photo_index():
+    dry_run = request.args.get("dryRun", "false").lower() == "true"
+    job = BackgroundJob(RECONCILE_JOB)
+    if job.start_in_thread(reconcile_job, photo_index, s3, dry_run=dry_run, disk_cache=thumb_cache):
+        return jsonify({"status": "started", "dryRun": dry_run}), 202
+    return jsonify({"status": "running", "progress": job.read()}), 409
+
+@app.route("/photo-index/reconcile/status")
+def reconcile_status():
+    return jsonify(BackgroundJob(RECONCILE_JOB).read())
 
 @app.route("/photo-index/random-chunk")
 @log_timing("photo-index/random-chunk")
@@ -179,27 +407,12 @@ def get_random_photo_chunk():
     require_faces = request.args.get("hasFaces", "false").lower() == "true"
     should_clear = request.args.get("clear", "false").lower() == "true"
 
-    key = f"{start}-{end}-{require_faces}"
-    if should_clear or len(used_indices_by_range[key]) >= len(photo_index):
-        used_indices_by_range[key].clear()
-
-    filtered = [
-        p for p in filter_photos_by_year_range(start, end)
-        if p["filename"] not in deleted_photos and (not require_faces or p.get("hasFaces", False))
-    ]
-    available = list(set(range(len(filtered))) - used_indices_by_range[key])
-    if not available:
-        return jsonify([])
-
-    selected = random.sample(available, size) if len(available) >= size else available
-    used_indices_by_range[key].update(selected)
-
-    return jsonify([filtered[i] for i in selected])
+    return jsonify(photo_sampler.deal(start, end, size, require_faces=require_faces, clear=should_clear))
 
 @app.route("/photo-index/clear-buffer")
 @log_timing("photo-index/clear-buffer")
 def clear_buffer():
-    used_indices_by_range.clear()
+    photo_sampler.clear()
     return jsonify({"status": "buffer cleared"})
 
 @app.route("/photo-index/delete", methods=["POST"])
@@ -208,14 +421,16 @@ def delete_photo():
     filename = data.get("filename")
     if not filename:
         return jsonify({"error": "Missing filename"}), 400
-    deleted_photos.add(filename)
-    with open("cache/deleted_photos.json", "w") as f:
-        json.dump(list(deleted_photos), f)
+    photo_index.delete(filename)
     return jsonify({"status": "deleted", "filename": filename})
 
+# The frontend still fetches the old file path; both come from the index now
 @app.route("/deleted-photos")
+@app.route("/cache/deleted_photos.json")
 def get_deleted_photos():
-    return jsonify(sorted(list(deleted_photos)))
+    # A reload swaps in a new set, so always go through photo_index
+    with photo_index.lock:
+        return jsonify(sorted(photo_index.deleted))
 
 @app.route("/photo-index/rotate", methods=["POST", "OPTIONS"])
 @log_timing("photo-index/rotate")
@@ -228,41 +443,13 @@ def rotate_photo():
     if not filename:
         return jsonify({"error": "Missing filename"}), 400
 
-    image_entry = next((x for x in photo_index if x["filename"] == filename), None)
+    image_entry = photo_index.get(filename)
     if not image_entry:
         return jsonify({"error": "Photo not found"}), 404
 
-    original_key = f"{S3_ORIGINALS_PREFIX}/{filename}"
-    rotated_cache_key = f"{S3_CACHE_PREFIX_ROTATED}/{filename}.webp"
-
-    try:
-        original_obj = s3.get_object(Bucket=S3_BUCKET, Key=original_key)
-        img = Image.open(BytesIO(original_obj["Body"].read())).convert("RGB")
-    except Exception as e:
-        print("[ERROR] Failed to fetch original image:", e)
-        return jsonify({"error": "Could not load original image"}), 500
-
-    new_angle = (image_entry.get("angle", 0) + 90) % 360
-    image_entry["angle"] = new_angle
-
-    rotated_img = img.rotate(-new_angle, expand=True)
-    w_percent = 600 / float(rotated_img.size[0])
-    h_size = int(float(rotated_img.size[1]) * w_percent)
-    resized_img = rotated_img.resize((600, h_size), Image.LANCZOS)
-
-    out_buffer = BytesIO()
-    resized_img.save(out_buffer, "WEBP")
-    out_buffer.seek(0)
-
-    s3.put_object(
-        Bucket=S3_BUCKET,
-        Key=rotated_cache_key,
-        Body=out_buffer.getvalue(),
-        ContentType="image/webp"
-    )
-
-    with open("cache/photo_index.json", "w", encoding="utf-8") as f:
-        json.dump(photo_index, f, indent=2)
+    # Metadata only (one row update): the rotated rendition is made on its
+    # first view, from the cached unrotated one when possible.
+    new_angle = photo_index.rotate(filename)
     return jsonify({"status": "rotated", "angle": new_angle, "filename": filename})
 
 @app.route("/cache/<path:filename>")
@@ -363,21 +550,89 @@ def add_to_photo_index():
         return jsonify({"error": "Missing required fields"}), 400
 
     new_entries = []
-    for fname in filenames:
-        entry = {
-            "filename": f"{year}/{folder}/{fname}",
-            "date": f"{year}-01-01",
-            "angle": 0,
-            "hasFaces": False  # Update later with face detection
-        }
-        photo_index.append(entry)
-        new_entries.append(entry)
-
-    with open("cache/photo_index.json", "w") as f:
-        json.dump(photo_index, f, indent=2)
+    with photo_index.transaction():
+        for fname in filenames:
+            entry = uploaded_entry(year, folder, fname)
+            new_entries.append(photo_index.add(entry) or entry)
 
     return jsonify({"status": "added", "count": len(new_entries)})
 
+def uploaded_entry(year, folder, fname):
+    return {
+        "filename": f"{year}/{folder}/{fname}",
+        "date": f"{year}-01-01",
+        "angle": 0,
+        "hasFaces": False  # Update later with face detection
+    }
+
+# --- BATCH MUTATIONS ---
+MAX_BATCH_OPERATIONS = 5000
+
+class BatchError(Exception):
+    index = None
+
+def apply_batch_operation(op):
+    if not isinstance(op, dict):
+        raise BatchError("Operation must be an object")
+    kind = op.get("op")
+
+    if kind == "delete":
+        filename = op.get("filename")
+        if not filename:
+            raise BatchError("Missing filename")
+        photo_index.delete(filename)
+        return {"op": kind, "filename": filename}
+
+    if kind == "rotate":
+        filename = op.get("filename")
+        step = op.get("step", 90)
+        if not isinstance(step, int) or step % 90:
+            raise BatchError("step must be a multiple of 90")
+        angle = photo_index.rotate(filename, step)
+        if angle is None:
+            raise BatchError(f"Photo not found: {filename}")
+        return {"op": kind, "filename": filename, "angle": angle}
+
+    if kind == "add":
+        year, folder, filenames = op.get("year"), op.get("folder"), op.get("filenames")
+        if not year or not folder or not filenames:
+            raise BatchError("Missing required fields")
+        for fname in filenames:
+            photo_index.add(uploaded_entry(year, folder, fname))
+        return {"op": kind, "count": len(filenames)}
+
+    raise BatchError(f"Unknown op: {kind}")
+
+# Many delete/rotate/add operations in one request, applied atomically:
+# one transaction and one commit for the whole batch. If any operation is
+# invalid nothing is applied (index and database both roll back).
+#   {"operations": [{"op": "delete", "filename": ...},
+#                   {"op": "rotate", "filename": ..., "step": 90},
+#                   {"op": "add", "year": ..., "folder": ..., "filenames": [...]}]}
+@app.route("/photo-index/batch", methods=["POST"])
+@log_timing("batch")
+def batch_photo_index():
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Missing operations"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}), 413
+
+    results = []
+    try:
+        with photo_index.transaction():
+            for i, op in enumerate(operations):
+                try:
+                    results.append(apply_batch_operation(op))
+                except BatchError as e:
+                    e.index = i
+                    raise
+    except BatchError as e:
+        return jsonify({"error": str(e), "index": e.index, "applied": 0}), 400
+
+    return jsonify({"status": "applied", "count": len(results), "results": results})
+
 @app.route("/frontend-log", methods=["POST"])
 def frontend_log():
     print("[FRONTEND LOG] Received log message")
@@ -395,53 +650,138 @@ def frontend_log():
 @log_timing("download-photo")
 def download_photo(filename):
     original_key = f"{S3_ORIGINALS_PREFIX}/{filename}"
-
-    try:
-        s3_response = s3.get_object(Bucket=S3_BUCKET, Key=original_key)
-        file_bytes = s3_response["Body"].read()
-
-        # Infer content type or default to binary stream
-        content_type = s3_response.get("ContentType", "application/octet-stream")
-        original_filename = os.path.basename(filename)
-
-        return send_file(
-            BytesIO(file_bytes),
-            mimetype=content_type,
-            as_attachment=True,
-            download_name=original_filename,
-        )
-
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "NoSuchKey":
-            print(f"[404] S3 Key Not Found: {original_key}")
-            return abort(404)
-        print(f"[ERROR] S3 download failed: {e}")
-        return abort(500)
-
+    return stream_s3_object(s3, S3_BUCKET, original_key, download_name=os.path.basename(filename))
+
+def optional_float(name):
+    value = request.args.get(name)
+    return float(value) if value else None
+
+# Answered from the in-memory video index (see video_index.py), which is
+# refreshed from S3 in the background when older than VIDEO_INDEX_MAX_AGE.
+# Filters: folder, codec, minDuration/maxDuration (seconds),
+# minHeight/maxHeight (pixels as displayed). sort is one of
+# VIDEO_SORT_FIELDS, order asc|desc.
+# Without a limit, keeps returning the plain filename list the frontend
+# expects; with one, full entries plus total and nextCursor.
 @app.route("/video-index/list")
+@log_timing("video-index/list")
 def list_videos():
     try:
-        paginator = s3.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=S3_BUCKET, Prefix="videos/originals/")
-
-        video_list = []
-        for page in page_iterator:
-            for obj in page.get("Contents", []):
-                key = obj["Key"]
-                if key.lower().endswith((".mp4", ".mov", ".avi", ".mkv")) and not key.endswith("/"):
-                    video_list.append(key.replace("videos/originals/", ""))
-
-        return jsonify({"videos": video_list})
-
+        refresh_if_stale(video_index, s3)
     except Exception as e:
         print(f"[ERROR] Failed to list videos: {e}")
         return jsonify({"error": "Failed to list videos"}), 500
+    video_index.sync()
+
+    sort = request.args.get("sort", "filename")
+    if sort not in VIDEO_SORT_FIELDS:
+        return jsonify({"error": f"sort must be one of {list(VIDEO_SORT_FIELDS)}"}), 400
+    try:
+        limit = request.args.get("limit")
+        videos, total, next_offset = video_index.query(
+            sort=sort,
+            descending=request.args.get("order", "asc").lower() == "desc",
+            offset=max(0, int(request.args.get("cursor") or 0)),
+            limit=max(1, min(int(limit), 5000)) if limit is not None else None,
+            folder=request.args.get("folder"),
+            codec=request.args.get("codec"),
+            min_duration=optional_float("minDuration"),
+            max_duration=optional_float("maxDuration"),
+            min_height=optional_float("minHeight"),
+            max_height=optional_float("maxHeight"),
+        )
+    except ValueError:
+        return jsonify({"error": "limit, cursor and the min/max filters must be numbers"}), 400
+
+    if limit is None:
+        return jsonify({"videos": [v["filename"] for v in videos]})
+    return jsonify({
+        "videos": videos,
+        "total": total,
+        "nextCursor": str(next_offset) if next_offset is not None else None,
+    })
+
+# Lists videos/originals/ and probes new or changed videos now instead of
+# waiting for the list endpoint to find the index stale. ?reprobe=true runs
+# ffprobe on every video again. Same job as `python video_index.py`.
+@app.route("/video-index/refresh", methods=["POST"])
+def refresh_videos():
+    reprobe = request.args.get("reprobe", "false").lower() == "true"
+    job = BackgroundJob(VIDEO_INDEX_JOB)
+    if job.start_in_thread(refresh_video_index, index_db, s3, reprobe=reprobe):
+        return jsonify({"status": "started"}), 202
+    return jsonify({"status": "running", "progress": job.read()}), 409
+
+@app.route("/video-index/refresh/status")
+def refresh_videos_status():
+    return jsonify(BackgroundJob(VIDEO_INDEX_JOB).read())
+
+# Plays an original from videos/originals/ in a <video> element. Seeks are
+# Range requests relayed to S3; open-ended ones get VIDEO_RANGE_WINDOW
+# bytes at a time, so jumping into a long video reads only around the
+# new position.
+@app.route("/stream-video/<path:filename>")
+@log_timing("stream-video")
+def stream_video(filename):
+    return stream_s3_object(
+        s3, S3_BUCKET, video_key(filename),
+        mimetype=video_mimetype(filename), max_range=VIDEO_RANGE_WINDOW,
+    )
+
+# --- HLS ---
+# Playlists and segments from cache-hls/ (see video_hls.py). A player
+# loads /hls/<video>/master.m3u8 and follows its relative URIs from there.
+# Playlists are rewritten when a video is transcoded again; segments can
+# be cached for a while.
+HLS_SEGMENT_CACHE_CONTROL = "public, max-age=3600"
+
+@app.route("/hls/<path:key>")
+@log_timing("hls")
+def serve_hls(key):
+    response = stream_s3_object(s3, S3_BUCKET, f"{S3_HLS_PREFIX}/{key}", mimetype=hls_mimetype(key))
+    if response.status_code in (200, 206):
+        response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL if key.endswith(".m3u8") else HLS_SEGMENT_CACHE_CONTROL
+    return response
+
+# On-demand transcode of one video into the HLS ladder. Answers right away:
+# "exists" with the playlist URL once it is done, otherwise 202 while a
+# transcode runs in the background (call again to poll; play
+# /stream-video/<video> meanwhile).
+@app.route("/generate-hls/<path:filename>", methods=["GET", "POST"])
+@log_timing("generate-hls")
+def generate_video_hls(filename):
+    try:
+        ready = hls_ready(s3, filename)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return jsonify({"error": "Video not found"}), 404
+        print(f"[S3 ERROR] HLS check failed for {filename}:", e)
+        return abort(500)
+    if ready:
+        return jsonify({"status": "exists", "playlist": f"/hls/{filename}/master.m3u8"})
+
+    job = hls_job(filename)
+    if job.start_in_thread(transcode_on_demand, s3, filename):
+        return jsonify({"status": "started"}), 202
+    return jsonify({"status": "running", "progress": job.read()}), 202
+
+# Every video without an up-to-date ladder; same job as `python video_hls.py`
+@app.route("/video-index/hls", methods=["POST"])
+def generate_all_video_hls():
+    job = BackgroundJob(HLS_JOB)
+    if job.start_in_thread(generate_hls, s3):
+        return jsonify({"status": "started"}), 202
+    return jsonify({"status": "running", "progress": job.read()}), 409
+
+@app.route("/video-index/hls/status")
+def video_hls_status():
+    return jsonify(BackgroundJob(HLS_JOB).read())
 
 @app.route("/generate-thumbnail/<path:filename>")
 @log_timing("generate-thumbnail")
 def generate_thumbnail(filename):
-    original_key = f"videos/originals/{filename}"
-    thumbnail_key = f"cache-video/{filename}.jpg"
+    original_key = video_key(filename)
+    thumbnail_key = poster_key(filename)
 
     # Check if thumbnail already exists
     try:
@@ -453,65 +793,65 @@ def generate_thumbnail(filename):
             return abort(500)
 
     try:
-        # 1. Download video from S3
-        video_obj = s3.get_object(Bucket=S3_BUCKET, Key=original_key)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_in:
-            tmp_in.write(video_obj["Body"].read())
-            tmp_in.flush()
-            input_path = tmp_in.name
-
-        # 2. Generate a unique output path
-        output_path = f"/tmp/{uuid.uuid4().hex}.jpg"
-
-        # 3. Use ffmpeg to extract thumbnail at 2 seconds
-        cmd = [
-            "ffmpeg",
-            "-y",                     # ✅ Force overwrite
-            "-loglevel", "error",
-            "-ss", "2",
-            "-i", input_path,
-            "-frames:v", "1",
-            "-q:v", "2",
-            output_path
-        ]
-        subprocess.run(cmd, check=True)
-
-        # 4. Upload thumbnail to S3
-        with open(output_path, "rb") as f:
-            s3.put_object(
-                Bucket=S3_BUCKET,
-                Key=thumbnail_key,
-                Body=f,
-                ContentType="image/jpeg"
-            )
-
+        # Reads only the ranges ffmpeg needs, straight from S3
+        thumbnail = video_thumbnail(s3, S3_BUCKET, original_key)
+        s3.put_object(
+            Bucket=S3_BUCKET,
+            Key=thumbnail_key,
+            Body=thumbnail,
+            ContentType="image/jpeg"
+        )
         return jsonify({"status": "generated"}), 200
 
     except Exception as e:
         print(f"[ERROR] Failed to generate thumbnail for {filename}:", e)
         return jsonify({"error": "Failed to generate thumbnail"}), 500
 
-    finally:
-        try:
-            os.remove(input_path)
-            os.remove(output_path)
-        except Exception as cleanup_err:
-            print(f"[WARN] Failed to clean up temp files: {cleanup_err}")
-
 @app.route("/cache-video/<path:filename>")
 @log_timing("serve-video-thumbnail")
 def serve_video_thumbnail(filename):
-    try:
-        print(f"[DEBUG] Fetching from S3: cache-video/{filename}")  # <--- ADD THIS LINE
-        response = s3.get_object(Bucket=S3_BUCKET, Key=f"cache-video/{filename}")
-        return send_file(BytesIO(response["Body"].read()), mimetype="image/jpeg")
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "NoSuchKey":
-            print(f"[404 DEBUG] Key not found: cache-video/{filename}")  # <--- ADD THIS TOO
-            return abort(404)
-        print(f"[ERROR] Failed to fetch thumbnail from S3: {e}")
-        return abort(500)
+    cache_key = f"{S3_VIDEO_THUMB_PREFIX}/{filename}"
+    etag = rendition_etag(cache_key)
+    cache_control = rendition_cache_control(VIDEO_THUMB_VERSION)
+
+    unchanged = not_modified(etag, cache_control)
+    if unchanged:
+        return unchanged
+
+    cached_path = thumb_cache.get(cache_key)
+    if not cached_path:
+        try:
+            response = s3.get_object(Bucket=S3_BUCKET, Key=cache_key)
+            cached_path = thumb_cache.put(cache_key, response["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                print(f"[404 DEBUG] Key not found: {cache_key}")
+                # Not generated yet: don't let the browser cache the miss
+                return Response(status=404, headers={"Cache-Control": "no-store"})
+            print(f"[ERROR] Failed to fetch thumbnail from S3: {e}")
+            return abort(500)
 
+    try:
+        return send_rendition(cached_path, etag, cache_mimetype(cache_key), cache_control)
+    except FileNotFoundError:
+        print(f"[CACHE] Evicted before send: {cache_key}")
+        return abort(503)
+
+# Posters plus scrubbing sprites (<video>.sprite.jpg/.sprite.json under
+# /cache-video/) for every video in the video index missing them; see
+# video_jobs.py. The same job runs from the CLI with `python video_jobs.py`.
+@app.route("/video-index/thumbnails", methods=["POST"])
+def generate_all_video_thumbnails():
+    refresh_if_stale(video_index, s3)
+    video_index.sync()
+    job = BackgroundJob(VIDEO_THUMB_JOB)
+    if job.start_in_thread(generate_video_thumbnails, s3, video_index.ordered()):
+        return jsonify({"status": "started"}), 202
+    return jsonify({"status": "running", "progress": job.read()}), 409
+
+@app.route("/video-index/thumbnails/status")
+def video_thumbnails_status():
+    return jsonify(BackgroundJob(VIDEO_THUMB_JOB).read())
 
 
 @app.route("/ping")
@@ -0,0 +1,153 @@
+from io import BytesIO
+from PIL import Image, ExifTags
+import pillow_heif
+
+pillow_heif.register_heif_opener()
+
+# --- RENDITION KEYS ---
+S3_ORIGINALS_PREFIX = "photos/originals"
+S3_CACHE_PREFIX_ROTATED = "cache-image/600px/rotated"
+S3_CACHE_PREFIX_UNROTATED = "cache-image/600px/unrotated"
+
+THUMBNAIL_WIDTH = 600
+RENDITION_SIZES = {"small": 200, "medium": 600, "large": 1600}
+
+def cache_prefixes(width=THUMBNAIL_WIDTH):
+    return f"cache-image/{width}px/rotated", f"cache-image/{width}px/unrotated"
+
+# Rotated renditions carry the angle in their key, so a rotate never changes
+# the bytes behind an existing key. Each width has its own prefix.
+def rendition_key(filename, angle, width=THUMBNAIL_WIDTH):
+    rotated_prefix, unrotated_prefix = cache_prefixes(width)
+    if angle:
+        return f"{rotated_prefix}/{filename}.r{angle}.webp"
+    return f"{unrotated_prefix}/{filename}.webp"
+
+# The ?v= that marks a rendition URL immutable: the angle, plus the start of
+# the original's ETag once reconcile has recorded it, so replacing an
+# original in S3 gives its renditions new URLs.
+def rendition_version(entry):
+    angle = entry.get("angle", 0)
+    etag = entry.get("etag")
+    return f"{angle}.{etag[:8]}" if etag else str(angle)
+
+# Accepts a size name ("small"), a known width ("200") or nothing.
+def parse_rendition_width(value):
+    if not value:
+        return THUMBNAIL_WIDTH
+    if value in RENDITION_SIZES:
+        return RENDITION_SIZES[value]
+    if value.isdigit() and int(value) in RENDITION_SIZES.values():
+        return int(value)
+    return None
+
+def original_key(filename):
+    return f"{S3_ORIGINALS_PREFIX}/{filename}"
+
+
+# --- DECODING ---
+# Decoding the original at full resolution is most of the cost of a cold
+# thumbnail, so decode only as many pixels as the largest requested width
+# needs: an embedded EXIF preview when it is big enough, otherwise JPEG DCT
+# draft scaling (1/2, 1/4 or 1/8 straight from the coefficients). HEIC goes
+# through libheif at full size; pillow_heif only reports the sizes of
+# embedded HEIF thumbnails, it can't decode them.
+EXIF_PREVIEW_OFFSET = 0x0201
+EXIF_PREVIEW_LENGTH = 0x0202
+QUARTER_TURNS = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+RESIZE_REDUCING_GAP = 3.0
+
+# Pre-rotation (w, h) whose rotated width is `width`, never upscaling.
+def _source_box(size, angle, width):
+    w, h = size
+    scale = width / float(h if angle in (90, 270) else w)
+    if scale >= 1:
+        return w, h
+    if angle in (90, 270):
+        return max(1, int(w * scale)), width
+    return width, max(1, int(h * scale))
+
+def _exif_preview(img):
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+    ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset, length = ifd1.get(EXIF_PREVIEW_OFFSET), ifd1.get(EXIF_PREVIEW_LENGTH)
+    if not offset or not length:
+        return None
+    start = offset + (6 if raw.startswith(b"Exif\x00\x00") else 0)
+    preview = Image.open(BytesIO(raw[start:start + length]))
+    preview.load()
+    return preview
+
+def _preview_fits(preview, img, box):
+    if preview.size[0] < box[0] or preview.size[1] < box[1]:
+        return False
+    # Some cameras letterbox their previews; only use same-shape ones
+    return abs(preview.size[0] / preview.size[1] - img.size[0] / img.size[1]) < 0.02
+
+# Returns (bitmap, full-resolution size); the bitmap may be smaller than
+# the original but is always at least `width` wide once rotated.
+def decode_for_width(data, angle, width):
+    img = Image.open(BytesIO(data))
+    full_size = img.size
+    box = _source_box(full_size, angle, width)
+
+    try:
+        preview = _exif_preview(img)
+        if preview is not None and _preview_fits(preview, img, box):
+            return preview.convert("RGB"), full_size
+    except Exception:
+        pass  # broken EXIF: fall back to the image itself
+
+    if img.format == "JPEG":
+        img.draft("RGB", box)
+    return img.convert("RGB"), full_size  # Ensure compatibility for all formats
+
+
+# --- RENDERING ---
+# Pure bytes -> bytes so it can run in the request, in a pool process or
+# in a batch job without touching S3.
+def _encode_webp(img):
+    buffer = BytesIO()
+    img.save(buffer, format="WEBP")
+    return buffer.getvalue()
+
+# Renders several widths from one decode. The plan is decode small, then
+# resize, then rotate: quarter turns are applied with a lossless transpose
+# on the already-small bitmap. Widths are produced largest first and each
+# smaller one is resized from the previous result. Widths larger than the
+# original keep the original width.
+def render_thumbnails(data, angle=0, widths=(THUMBNAIL_WIDTH,)):
+    widths = sorted(set(widths), reverse=True)
+    angle = angle % 360
+    img, full_size = decode_for_width(data, angle, widths[0])
+
+    transpose = QUARTER_TURNS.get(angle)
+    if angle and transpose is None:
+        img = img.rotate(-angle, expand=True)  # free-form angle: rotate first
+        full_size, angle = img.size, 0
+
+    rendered = {}
+    for width in widths:
+        # Sized against the original so every width matches a direct resize
+        box = _source_box(full_size, angle, width)
+        if box[0] > img.size[0] or box[1] > img.size[1]:
+            box = img.size
+        if box != img.size:
+            img = img.resize(box, Image.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+        rendered[width] = _encode_webp(img.transpose(transpose) if transpose else img)
+    return rendered
+
+# Width `data` (any encoded image) ends up with after rotating by `angle`;
+# reads the header only.
+def rotated_width(data, angle):
+    w, h = Image.open(BytesIO(data)).size
+    return h if angle % 180 == 90 else w
+
+def render_thumbnail(data, angle=0, width=THUMBNAIL_WIDTH):
+    return render_thumbnails(data, angle, (width,))[width]
@@ -0,0 +1,129 @@
+import os
+import gzip
+import hashlib
+import threading
+from flask import Response, request
+
+# brotli and zstandard are optional: without them only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- COMPRESSION CONFIGURATION ---
+MIN_COMPRESS_BYTES = int(os.getenv("MIN_COMPRESS_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 6
+
+COMPRESSIBLE_MIMETYPES = ("application/json",)
+
+
+def _zstd(data):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+def _brotli(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+# Server preference order, used when the client weighs them equally
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = _zstd
+if brotli is not None:
+    ENCODERS["br"] = _brotli
+ENCODERS["gzip"] = _gzip
+
+
+def negotiate_encoding():
+    return request.accept_encodings.best_match(ENCODERS)
+
+
+# --- PRE-ENCODED PAYLOADS ---
+# Serialized bytes plus each compressed variant, made once and then sent as
+# is. The ETag is a digest of the uncompressed bytes, so every worker that
+# holds the same content hands out the same one.
+class EncodedPayload:
+    def __init__(self, data, mimetype="application/json", headers=None):
+        self.data = data
+        self.mimetype = mimetype
+        self.headers = headers or {}
+        self.digest = hashlib.blake2b(data, digest_size=10).hexdigest()
+        self.variants = {}
+        self.lock = threading.Lock()
+
+    def variant(self, encoding):
+        if encoding is None:
+            return self.data
+        body = self.variants.get(encoding)
+        if body is None:
+            with self.lock:
+                body = self.variants.get(encoding)
+                if body is None:
+                    body = self.variants[encoding] = ENCODERS[encoding](self.data)
+        return body
+
+    def etag(self, encoding):
+        return f"{self.digest}-{encoding}" if encoding else self.digest
+
+    def response(self, cache_control="no-cache"):
+        encoding = negotiate_encoding()
+        etag = self.etag(encoding)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variant(encoding), mimetype=self.mimetype)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+            response.headers.update(self.headers)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+# Holds the payload for one version of some content. `build` (returning an
+# EncodedPayload) runs at most once per version, whichever thread gets there
+# first.
+class PayloadCache:
+    def __init__(self):
+        self.version = None
+        self.payload = None
+        self.lock = threading.Lock()
+
+    def get(self, version, build):
+        if self.version == version:
+            return self.payload
+        with self.lock:
+            if self.version != version:
+                self.payload = build()
+                self.version = version
+            return self.payload
+
+
+# --- DYNAMIC RESPONSES ---
+# after_request hook: compresses JSON bodies the client accepts an encoding
+# for. Streamed, already-encoded and small responses pass through.
+def compress_response(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    encoding = negotiate_encoding()
+    if encoding is None or len(data) < MIN_COMPRESS_BYTES:
+        return response
+    response.set_data(ENCODERS[encoding](data))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,26 @@
+import os
+
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+
+# The CLI jobs read .env the same way the server does
+load_dotenv()
+
+# --- S3 CONFIGURATION ---
+# S3_ENDPOINT_URL points the server, both serving modes and every job at a
+# local S3 stand-in; region and credentials come from the usual AWS_*
+# variables.
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# A client is shared by all the threads of a process. Its pool must cover
+# them: past max_pool_connections, connections are opened for one request
+# and thrown away (a new TCP/TLS handshake each).
+S3_MAX_CONNECTIONS = int(os.getenv("S3_MAX_CONNECTIONS", "50"))
+
+
+def make_s3_client():
+    return boto3.client(
+        "s3",
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(max_pool_connections=S3_MAX_CONNECTIONS, tcp_keepalive=True),
+    )
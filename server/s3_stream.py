@@ -0,0 +1,124 @@
+import re
+from urllib.parse import quote
+from flask import Response, abort, request, stream_with_context
+from botocore.exceptions import ClientError
+
+STREAM_CHUNK_SIZE = 256 * 1024
+# Most bytes one open-ended video Range request is answered with
+VIDEO_RANGE_WINDOW = 8 * 1024 * 1024
+
+OPEN_RANGE = re.compile(r"bytes=(\d+)-")
+
+
+def content_disposition(download_name):
+    try:
+        download_name.encode("ascii")
+        return f"attachment; filename=\"{download_name}\""
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+
+def _if_range_allows(if_range, etag, last_modified):
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag and not if_range.startswith("W/")
+    return last_modified is not None and if_range == last_modified
+
+
+# Turns an open-ended "bytes=N-" into at most max_bytes starting at N. Media
+# players ask for "bytes=N-" on every seek and request the next range when
+# a 206 ends short of the object, so a seek reads a bounded window from S3
+# instead of the rest of the file, and the window is read to the end, which
+# puts its S3 connection back in the pool instead of closing it.
+def clamp_open_range(range_header, max_bytes):
+    match = OPEN_RANGE.fullmatch(range_header.strip())
+    if not match:
+        return range_header
+    start = int(match.group(1))
+    return f"bytes={start}-{start + max_bytes - 1}"
+
+
+# --- S3 STREAMING ---
+# Relays an S3 object to the client in fixed-size chunks instead of reading
+# it into memory. Range requests are passed through to S3 (206 + the
+# Content-Range S3 returns); If-Range is honored against the object's
+# ETag/Last-Modified, falling back to the full object when it doesn't match.
+# With max_range, open-ended ranges are clamped (see clamp_open_range).
+def stream_s3_object(s3, bucket, key, mimetype=None, download_name=None, chunk_size=STREAM_CHUNK_SIZE, max_range=None):
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+
+    params = {"Bucket": bucket, "Key": key}
+    if range_header and if_range:
+        head = _head_object(s3, bucket, key)
+        last_modified = head["LastModified"].strftime("%a, %d %b %Y %H:%M:%S GMT")
+        if not _if_range_allows(if_range, head.get("ETag"), last_modified):
+            range_header = None
+        else:
+            params["IfMatch"] = head["ETag"]  # don't splice ranges of two different versions
+    if range_header and max_range:
+        range_header = clamp_open_range(range_header, max_range)
+    if range_header:
+        params["Range"] = range_header
+
+    try:
+        s3_response = s3.get_object(**params)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ("NoSuchKey", "404"):
+            print(f"[404] S3 Key Not Found: {key}")
+            return abort(404)
+        if code == "InvalidRange":
+            size = e.response["Error"].get("ActualObjectSize")
+            headers = {"Content-Range": f"bytes */{size}"} if size else {}
+            return Response(status=416, headers=headers)
+        if code == "PreconditionFailed":
+            # Object changed between HEAD and GET: send the new one in full
+            params.pop("Range", None)
+            params.pop("IfMatch", None)
+            s3_response = s3.get_object(**params)
+        else:
+            print(f"[ERROR] S3 stream failed for {key}: {e}")
+            return abort(500)
+
+    body = s3_response["Body"]
+
+    def generate():
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(s3_response["ContentLength"]),
+    }
+    if s3_response.get("ETag"):
+        headers["ETag"] = s3_response["ETag"]
+    if s3_response.get("LastModified"):
+        headers["Last-Modified"] = s3_response["LastModified"].strftime("%a, %d %b %Y %H:%M:%S GMT")
+    if s3_response.get("ContentRange"):
+        headers["Content-Range"] = s3_response["ContentRange"]
+    if download_name:
+        headers["Content-Disposition"] = content_disposition(download_name)
+
+    return Response(
+        stream_with_context(generate()),
+        status=206 if s3_response.get("ContentRange") else 200,
+        mimetype=mimetype or s3_response.get("ContentType", "application/octet-stream"),
+        headers=headers,
+        direct_passthrough=True,
+    )
+
+
+def _head_object(s3, bucket, key):
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            print(f"[404] S3 Key Not Found: {key}")
+            return abort(404)
+        print(f"[ERROR] S3 head failed for {key}: {e}")
+        return abort(500)
@@ -0,0 +1,76 @@
+import index_reconcile
+from index_reconcile import apply_diff, diff_index, invalidate_renditions
+from photo_index_store import PhotoIndex
+from renditions import rendition_key
+
+META = {"etag": "0" * 32, "size": 1, "last_modified": "2020-01-01T00:00:00+00:00"}
+
+
+def test_only_photo_extensions_are_added():
+    index = PhotoIndex()
+    listing = {"2020/a.jpg": META, "2020/notes.txt": META, "2020/._a.jpg": META}
+    adds, removals, refreshed, replaced = diff_index(index, listing)
+    assert [e["filename"] for e in adds] == ["2020/a.jpg"]
+    assert removals == [] and refreshed == {} and replaced == []
+
+
+def test_indexed_files_of_any_type_are_kept_while_their_object_exists():
+    index = PhotoIndex([
+        {"filename": "2020/a.heif", **META},
+        {"filename": "2020/b.dng", **META},
+        {"filename": "2020/gone.gif", **META},
+    ], deleted=["2020/a.heif"])
+    listing = {"2020/a.heif": META, "2020/b.dng": {**META, "size": 2}}
+    adds, removals, refreshed, replaced = diff_index(index, listing)
+    assert adds == []
+    assert removals == ["2020/gone.gif"]
+    assert refreshed == {"2020/b.dng": {**META, "size": 2}}
+    assert replaced == []
+
+
+def test_only_a_changed_etag_counts_as_replaced():
+    index = PhotoIndex([
+        {"filename": "2020/new.jpg"},
+        {"filename": "2020/same.jpg", **META},
+        {"filename": "2020/changed.jpg", **META},
+    ])
+    listing = {f: META for f in ("2020/new.jpg", "2020/same.jpg")}
+    listing["2020/changed.jpg"] = {**META, "etag": "1" * 32}
+    adds, removals, refreshed, replaced = diff_index(index, listing)
+    assert sorted(refreshed) == ["2020/changed.jpg", "2020/new.jpg"]
+    assert replaced == ["2020/changed.jpg"]
+
+
+def test_apply_diff_in_batches(monkeypatch):
+    monkeypatch.setattr(index_reconcile, "RECONCILE_BATCH", 3)
+    index = PhotoIndex([{"filename": f"2020/{i}.jpg"} for i in range(10)])
+    adds = [{"filename": f"2021/{i}.jpg"} for i in range(7)]
+    refreshed = {f"2020/{i}.jpg": META for i in range(5)}
+    apply_diff(index, adds, ["2020/9.jpg"], refreshed)
+    assert len(index) == 16
+    assert "2020/9.jpg" not in index
+    assert all(index.get(f)["etag"] == META["etag"] for f in refreshed)
+
+
+class FakeS3:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_objects(self, Bucket, Delete):
+        self.deleted.extend(obj["Key"] for obj in Delete["Objects"])
+
+
+class FakeDiskCache:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, key):
+        self.deleted.append(key)
+
+
+def test_invalidate_renditions_drops_every_size_and_angle():
+    s3, disk = FakeS3(), FakeDiskCache()
+    assert invalidate_renditions(s3, ["2020/a.jpg"], disk) == 12
+    assert rendition_key("2020/a.jpg", 0, 200) in s3.deleted
+    assert rendition_key("2020/a.jpg", 270, 1600) in s3.deleted
+    assert disk.deleted == s3.deleted
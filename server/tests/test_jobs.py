@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import BackgroundJob, run_bounded
+from video_jobs import find_missing
+from video_thumbnails import poster_key, sprite_index_key, sprite_key
+
+
+def test_run_bounded_records_every_outcome_and_bounds_the_queue(tmp_path):
+    job = BackgroundJob("test", jobs_dir=str(tmp_path))
+    job.begin(20)
+    lock = threading.Lock()
+    in_flight, peak, results = [0], [0], []
+
+    def task(n):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            if n % 5 == 0:
+                raise ValueError(n)
+            return n
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        run_bounded(job, pool, task, [(n,) for n in range(20)], depth=3, on_done=results.append)
+
+    assert (job.state["done"], job.state["failed"]) == (16, 4)
+    assert sorted(results) == [n for n in range(20) if n % 5]
+    assert peak[0] <= 3
+
+
+def test_video_jobs_take_the_duration_from_the_index():
+    videos = [
+        {"filename": "a.mp4", "duration": 12.5},
+        {"filename": "b.mov", "duration": None},
+        {"filename": "c.mp4", "duration": 3.0},
+    ]
+    existing = {poster_key("c.mp4"), sprite_key("c.mp4"), sprite_index_key("c.mp4"), poster_key("b.mov")}
+    assert find_missing(videos, existing) == [("a.mp4", True, True, 12.5), ("b.mov", False, True, None)]
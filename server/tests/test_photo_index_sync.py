@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import index_db
+from index_db import IndexDB
+from photo_index_store import PhotoIndex
+
+
+def photo(filename, **fields):
+    return {"filename": filename, "date": "2020-05-01", "angle": 0, "hasFaces": False, **fields}
+
+
+# Two workers: one PhotoIndex each, on their own connection to the same file
+@pytest.fixture
+def workers(tmp_path):
+    path = str(tmp_path / "photo_index.db")
+    a = PhotoIndex.from_store(IndexDB(path))
+    b = PhotoIndex.from_store(IndexDB(path))
+    b.sync()
+    return a, b
+
+
+def test_sync_replays_the_other_workers_changes(workers):
+    a, b = workers
+    a.add(photo("2020/a.jpg"))
+    a.add(photo("2020/b.jpg"))
+    a.add(photo("2021/c.jpg", date="2021-01-01"))
+    a.rotate("2020/a.jpg")
+    a.delete("2020/b.jpg")
+    a.remove_many(["2021/c.jpg"])
+    a.update("2020/a.jpg", date="2019-12-31")
+
+    b.sync()
+    assert b.get("2020/a.jpg") == a.get("2020/a.jpg")
+    assert b.get("2020/a.jpg")["angle"] == 90
+    assert b.is_deleted("2020/b.jpg")
+    assert "2021/c.jpg" not in b
+    assert b.year_bounds() == a.year_bounds() == (2019, 2020)
+    assert b.synced == a.synced
+
+
+def test_replay_is_idempotent_for_own_changes(workers):
+    a, b = workers
+    a.add(photo("2020/a.jpg"))
+    b.delete("2020/a.jpg")
+    a.sync()
+    b.sync()
+    assert a.live() == b.live() == []
+    assert a.deleted == b.deleted == {"2020/a.jpg"}
+
+
+def test_rolled_back_transaction_is_undone_everywhere(workers):
+    a, b = workers
+    a.add(photo("2020/kept.jpg"))
+    with pytest.raises(RuntimeError):
+        with a.transaction():
+            a.add(photo("2020/new.jpg"))
+            a.delete("2020/kept.jpg")
+            a.rotate("2020/kept.jpg")
+            a.remove_many(["2020/kept.jpg"])
+            raise RuntimeError("boom")
+
+    assert "2020/new.jpg" not in a
+    assert a.get("2020/kept.jpg")["angle"] == 0
+    assert not a.is_deleted("2020/kept.jpg")
+    b.sync()
+    assert [e["filename"] for e in b] == ["2020/kept.jpg"]
+    assert not b.deleted
+
+
+def test_sync_reloads_once_the_log_is_compacted(workers, monkeypatch):
+    monkeypatch.setattr(index_db, "CHANGE_LOG_KEEP", 5)
+    monkeypatch.setattr(index_db, "CHANGE_LOG_PRUNE_EVERY", 5)
+    a, b = workers
+    names = [f"2020/{i}.jpg" for i in range(30)]
+    for name in names:
+        a.add(photo(name))
+    for name in names[:20]:
+        a.delete(name)
+    assert a.store.changes_since(b.synced) is None
+
+    before = b.deleted
+    b.sync()
+    assert b.deleted is not before  # the reload swaps the set: never hold on to it
+    assert b.deleted == a.deleted == set(names[:20])
+    assert b.live() == a.live()
+    assert b.synced == a.synced
+
+
+def test_reads_do_not_wait_behind_a_transaction_waiting_on_the_store(tmp_path):
+    path = str(tmp_path / "photo_index.db")
+    a = PhotoIndex.from_store(IndexDB(path))
+    a.add(photo("2020/a.jpg"))
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    writer = threading.Thread(target=a.delete, args=("2020/a.jpg",))
+    writer.start()
+    try:
+        time.sleep(0.2)  # the writer is now waiting for the write lock
+        start = time.perf_counter()
+        assert a.get("2020/a.jpg") is not None
+        assert time.perf_counter() - start < 0.1
+    finally:
+        other.execute("ROLLBACK")
+    writer.join()
+    assert a.is_deleted("2020/a.jpg")
@@ -0,0 +1,81 @@
+import sqlite3
+import time
+
+import pytest
+
+import photo_sampler
+from index_db import IndexDB
+from photo_index_store import PhotoIndex
+from photo_sampler import PhotoSampler, ShuffledDeck, permute
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5, 7, 16, 17, 100, 1000, 4097])
+@pytest.mark.parametrize("seed", [0, 1, 0xDEADBEEF])
+def test_permute_is_a_permutation(n, seed):
+    assert sorted(permute(i, n, seed) for i in range(n)) == list(range(n))
+
+
+def test_permute_depends_on_seed():
+    n = 1000
+    assert [permute(i, n, 1) for i in range(n)] != [permute(i, n, 2) for i in range(n)]
+
+
+@pytest.mark.parametrize("lo, hi", [(0, 1), (0, 15), (40, 1040)])
+def test_deck_never_repeats_within_a_cycle(lo, hi):
+    deck = ShuffledDeck(lo, hi, layout_version=1, seed=1234)
+    dealt = []
+    while deck.remaining():
+        dealt.extend(deck.deal(15, lambda pos: True))
+    assert sorted(dealt) == list(range(lo, hi))
+    assert deck.deal(15, lambda pos: True) == []
+
+
+def test_deck_skips_rejected_positions_without_repeating():
+    deck = ShuffledDeck(0, 500, layout_version=1, seed=99)
+    dealt = []
+    while deck.remaining():
+        dealt.extend(deck.deal(15, lambda pos: pos % 3 != 0))
+    assert sorted(dealt) == [pos for pos in range(500) if pos % 3 != 0]
+
+
+def test_deck_resumes_from_saved_seed_and_cursor():
+    deck = ShuffledDeck(0, 300, layout_version=1, seed=7)
+    first = deck.deal(100, lambda pos: True)
+    resumed = ShuffledDeck(0, 300, layout_version=1, seed=deck.seed, cursor=deck.cursor)
+    rest = resumed.deal(300, lambda pos: True)
+    assert sorted(first + rest) == list(range(300))
+
+
+# Two workers dealing from the shared deck in the database
+@pytest.fixture
+def samplers(tmp_path):
+    path = str(tmp_path / "photo_index.db")
+    a = PhotoIndex.from_store(IndexDB(path))
+    with a.transaction():
+        for i in range(50):
+            a.add({"filename": f"2020/{i}.jpg", "date": "2020-01-01", "angle": 0, "hasFaces": False})
+    b = PhotoIndex.from_store(IndexDB(path))
+    return path, PhotoSampler(a), PhotoSampler(b)
+
+
+def test_shared_deck_never_repeats_across_workers(samplers):
+    _, a, b = samplers
+    dealt = []
+    while len(dealt) < 50:
+        chunk = (a if len(dealt) % 2 else b).deal(2020, 2020, 7)
+        assert chunk
+        dealt.extend(e["filename"] for e in chunk)
+    assert sorted(dealt) == sorted(f"2020/{i}.jpg" for i in range(50))
+
+
+def test_deal_does_not_wait_for_a_busy_write_lock(samplers, monkeypatch):
+    monkeypatch.setattr(photo_sampler, "DECK_SAVE_TIMEOUT", 0.1)
+    path, a, _ = samplers
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.perf_counter()
+        assert len(a.deal(2020, 2020, 7)) == 7
+        assert time.perf_counter() - start < 2
+    finally:
+        other.execute("ROLLBACK")
@@ -0,0 +1,203 @@
+import os
+import time
+import errno
+import fcntl
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# --- DISK CACHE CONFIGURATION ---
+THUMB_CACHE_DIR = os.getenv("THUMB_CACHE_DIR", "cache/thumbs")
+THUMB_CACHE_MAX_MB = int(os.getenv("THUMB_CACHE_MAX_MB", "2048"))
+THUMB_CACHE_POLICY = os.getenv("THUMB_CACHE_POLICY", "lru")  # "lru" or "fifo"
+
+TRIM_TARGET = 0.9          # trim down to 90% of the cap
+STALE_TMP_SECONDS = 3600   # leftovers from crashed writers
+FLIGHT_TIMEOUT = 120       # give up waiting on another worker's render
+FLIGHT_POLL = 0.05
+
+
+# --- DISK CACHE ---
+# Size-bounded local tier for rendered thumbnails, keyed by the same
+# rendition key used in S3. Files are written to a temp name and renamed
+# into place, so gunicorn workers sharing the directory only ever see
+# complete files. Recency lives in each file's mtime (touched on hit for
+# "lru", left alone for "fifo"), which keeps the state on disk and lets it
+# survive restarts. Trimming is guarded by an flock so only one worker
+# scans the directory at a time.
+class DiskCache:
+    def __init__(self, root=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_MB * 1024 * 1024, policy=THUMB_CACHE_POLICY):
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"Unknown thumbnail cache policy: {policy}")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.trim_every = max(max_bytes // 20, 1024 * 1024)
+        self.written_since_trim = 0
+        self.lock_dir = os.path.join(self.root, ".locks")
+        self.flights = {}
+        self.flights_lock = threading.Lock()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def digest(self, key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        digest = self.digest(key)
+        ext = os.path.splitext(key)[1]
+        return os.path.join(self.root, digest[:2], digest[2:] + ext)
+
+    # Returns the local path for a cached key, or None on a miss.
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            if self.policy == "lru":
+                os.utime(path)
+            else:
+                os.stat(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self.written_since_trim += len(data)
+        if self.written_since_trim >= self.trim_every:
+            self.written_since_trim = 0
+            self.trim()
+        return path
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    # --- SINGLE-FLIGHT ---
+    # Serializes work on one key: first a per-key thread lock inside this
+    # worker, then an flock on a per-key lock file shared by every worker.
+    # Callers re-check the cache once inside, so only the first request for
+    # a missing rendition renders it and the rest pick up its result.
+    @contextmanager
+    def single_flight(self, key):
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = [threading.Lock(), 0]
+            flight[1] += 1
+
+        try:
+            with flight[0]:
+                with self._file_lock(key):
+                    yield
+        finally:
+            with self.flights_lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self.flights[key]
+
+    @contextmanager
+    def _file_lock(self, key):
+        lock_path = os.path.join(self.lock_dir, self.digest(key) + ".lock")
+        with open(lock_path, "a") as lock_file:
+            deadline = time.monotonic() + FLIGHT_TIMEOUT
+            locked = False
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if time.monotonic() >= deadline:
+                    print(f"[CACHE] Timed out waiting on in-flight render of {key}")
+                    break
+                time.sleep(FLIGHT_POLL)
+            try:
+                yield
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _trim_locks(self):
+        now = time.time()
+        for item in os.scandir(self.lock_dir):
+            try:
+                if now - item.stat().st_mtime <= STALE_TMP_SECONDS:
+                    continue
+                with open(item.path, "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(item.path)
+            except (FileNotFoundError, BlockingIOError):
+                pass  # gone already, or a render is holding it
+
+    # --- EVICTION ---
+    def _scan(self):
+        files = []
+        now = time.time()
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith("."):
+                continue
+            for item in os.scandir(shard.path):
+                try:
+                    st = item.stat()
+                except FileNotFoundError:
+                    continue
+                if item.name.startswith(".tmp-"):
+                    if now - st.st_mtime > STALE_TMP_SECONDS:
+                        self._remove(item.path)
+                    continue
+                files.append((st.st_mtime, st.st_size, item.path))
+        return files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def trim(self):
+        lock_path = os.path.join(self.root, ".trim.lock")
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return 0  # another worker is already trimming
+                raise
+
+            self._trim_locks()
+            files = self._scan()
+            total = sum(size for _, size, _ in files)
+            if total <= self.max_bytes:
+                return 0
+
+            target = int(self.max_bytes * TRIM_TARGET)
+            removed = 0
+            files.sort()
+            for _, size, path in files:
+                if total <= target:
+                    break
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+            print(f"[CACHE] Trimmed {removed} thumbnails from {self.root}")
+            return removed
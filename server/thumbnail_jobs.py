@@ -0,0 +1,97 @@
+import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from jobs import run_bounded, run_cli
+from renditions import (
+    S3_CACHE_PREFIX_ROTATED,
+    S3_CACHE_PREFIX_UNROTATED,
+    original_key,
+    rendition_key,
+    render_thumbnail,
+)
+from photo_index_store import PhotoIndex
+from index_db import IndexDB, PHOTO_INDEX_DB
+from s3_client import make_s3_client
+
+S3_BUCKET = "photo-video-repository"
+PREGENERATE_JOB = "pregenerate-thumbnails"
+PREGENERATE_WORKERS = int(os.getenv("PREGENERATE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+_s3 = None
+
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = make_s3_client()
+    return _s3
+
+
+# --- LISTING ---
+# One paginated listing per cache prefix instead of a HEAD per photo.
+def list_existing_keys(s3, prefixes=(S3_CACHE_PREFIX_UNROTATED, S3_CACHE_PREFIX_ROTATED)):
+    existing = set()
+    paginator = s3.get_paginator("list_objects_v2")
+    for prefix in prefixes:
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{prefix}/"):
+            for obj in page.get("Contents", []):
+                existing.add(obj["Key"])
+    return existing
+
+
+def find_missing(entries, existing):
+    missing = []
+    for entry in entries:
+        key = rendition_key(entry["filename"], entry.get("angle", 0))
+        if key not in existing:
+            missing.append((entry["filename"], entry.get("angle", 0), key))
+    return missing
+
+
+# --- POOL TASK ---
+# Runs in a pool process: download, render, upload. Each process keeps its
+# own S3 client.
+def generate_one(filename, angle, cache_key):
+    s3 = get_s3()
+    original = s3.get_object(Bucket=S3_BUCKET, Key=original_key(filename))["Body"].read()
+    data = render_thumbnail(original, angle)
+    s3.put_object(Bucket=S3_BUCKET, Key=cache_key, Body=data, ContentType="image/webp")
+    return cache_key
+
+
+# --- JOB ---
+# Re-runs are idempotent and resume where the last run stopped: whatever is
+# already under the cache prefixes is skipped.
+def pregenerate_thumbnails(job, entries, workers=PREGENERATE_WORKERS, on_generated=None):
+    existing = list_existing_keys(get_s3())
+    missing = find_missing(entries, existing)
+    job.begin(len(missing), skipped=len(entries) - len(missing), workers=workers)
+    print(f"[JOB] {job.name}: {len(missing)} missing of {len(entries)} renditions")
+
+    # spawn: pool processes must not inherit gunicorn's threads and sockets
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # At most 2 tasks per process queued
+        run_bounded(job, pool, generate_one, missing, workers * 2, on_done=on_generated)
+
+    job.finish()
+    return job.state
+
+
+def load_index_entries(path=PHOTO_INDEX_DB):
+    index_db = IndexDB(path)
+    index_db.migrate_from_json()
+    return PhotoIndex.from_store(index_db).live()
+
+
+# --- CLI ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate missing 600px WebP thumbnails")
+    parser.add_argument("--workers", type=int, default=PREGENERATE_WORKERS)
+    parser.add_argument("--db", default=PHOTO_INDEX_DB)
+    args = parser.parse_args()
+
+    state = run_cli(PREGENERATE_JOB, pregenerate_thumbnails, load_index_entries(args.db), workers=args.workers)
+    print(f"✅ Generated {state['done']} thumbnails ({state['failed']} failed, {state['per_second']}/s)")
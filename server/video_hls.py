@@ -0,0 +1,303 @@
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from jobs import BackgroundJob, JOBS_DIR, run_cli
+from s3_client import make_s3_client
+from video_index import list_videos, video_metadata
+from video_thumbnails import FFMPEG_BIN, video_key, probe
+
+S3_BUCKET = "photo-video-repository"
+S3_HLS_PREFIX = "cache-hls"
+HLS_JOB = "video-hls"
+# Per-video locks and on-demand progress, one file pair per video
+HLS_JOBS_DIR = os.path.join(JOBS_DIR, "hls")
+
+# --- HLS CONFIGURATION ---
+# (name, short side in pixels, video bits/s, audio bits/s). Rungs taller
+# than the original are skipped. The master playlist lists them in this
+# order, so players start on the cheapest one and switch up.
+HLS_LADDER = (
+    ("360p", 360, 800_000, 96_000),
+    ("720p", 720, 2_800_000, 128_000),
+    ("1080p", 1080, 5_000_000, 160_000),
+)
+# Short segments with a keyframe at every boundary: the first segment of
+# the 360p rung is a couple of hundred KB, so playback starts after one
+# small fetch.
+HLS_SEGMENT_SECONDS = 2
+
+# Bounded CPU: transcodes run at low priority (nice), each ffmpeg encoder
+# gets HLS_FFMPEG_THREADS threads, and a process runs at most HLS_WORKERS
+# on-demand transcodes at once (the batch job runs --workers of them).
+HLS_WORKERS = int(os.getenv("HLS_WORKERS", "1"))
+HLS_FFMPEG_THREADS = int(os.getenv("HLS_FFMPEG_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+HLS_NICE = 10
+HLS_TIMEOUT = int(os.getenv("HLS_TIMEOUT", str(3 * 60 * 60)))
+HLS_UPLOAD_WORKERS = 8
+
+HLS_MIMETYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".json": "application/json",
+}
+
+transcode_slots = threading.BoundedSemaphore(HLS_WORKERS)
+
+
+# --- HLS KEYS ---
+# cache-hls/<video>/master.m3u8, <rung>/index.m3u8, <rung>/seg_NNNNN.ts and
+# hls.json, which is written last and marks the video as done.
+def hls_prefix(filename):
+    return f"{S3_HLS_PREFIX}/{filename}/"
+
+def master_key(filename):
+    return f"{hls_prefix(filename)}master.m3u8"
+
+def marker_key(filename):
+    return f"{hls_prefix(filename)}hls.json"
+
+def hls_mimetype(key):
+    return HLS_MIMETYPES.get(os.path.splitext(key)[1], "application/octet-stream")
+
+def hls_job(filename):
+    digest = hashlib.blake2b(filename.encode("utf-8"), digest_size=10).hexdigest()
+    return BackgroundJob(f"hls-{digest}", jobs_dir=HLS_JOBS_DIR)
+
+
+# --- STATE ---
+# A video is done when its marker is newer than its original, so an
+# original uploaded again under the same name is transcoded again.
+def is_ready(marker_modified, original_modified):
+    return marker_modified is not None and marker_modified >= original_modified
+
+
+# {filename: marker last-modified} from one listing of cache-hls/
+def list_markers(s3):
+    markers = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{S3_HLS_PREFIX}/"):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/hls.json"):
+                markers[key[len(S3_HLS_PREFIX) + 1:-len("/hls.json")]] = obj["LastModified"].isoformat()
+    return markers
+
+
+# True/False for one video; raises ClientError when the original is missing
+def hls_ready(s3, filename):
+    original = s3.head_object(Bucket=S3_BUCKET, Key=video_key(filename))
+    try:
+        marker = s3.head_object(Bucket=S3_BUCKET, Key=marker_key(filename))
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return False
+    return is_ready(marker["LastModified"], original["LastModified"])
+
+
+# --- TRANSCODING ---
+# Rungs for a video of this displayed size; one at the original's size when
+# it is smaller than the lowest rung.
+def ladder_for(width, height):
+    if not width or not height:
+        return HLS_LADDER[:1]
+    short = min(width, height)
+    rungs = [rung for rung in HLS_LADDER if rung[1] <= short]
+    if not rungs:
+        name, _, video_rate, audio_rate = HLS_LADDER[0]
+        rungs = [(name, short - short % 2, video_rate, audio_rate)]
+    return rungs
+
+
+# One decode, split into a scaled encode per rung; ffmpeg's HLS muxer
+# writes <rung>/index.m3u8 + segments and the master playlist. ffmpeg
+# applies the original's rotation while decoding, so the output is upright
+# and `portrait` (from the displayed size) decides which side is scaled.
+def hls_command(source, out_dir, rungs, portrait, has_audio, threads=HLS_FFMPEG_THREADS):
+    count = len(rungs)
+    graph = [f"[0:v]split={count}" + "".join(f"[s{i}]" for i in range(count))]
+    for i, (_, size, _, _) in enumerate(rungs):
+        graph.append(f"[s{i}]scale={f'{size}:-2' if portrait else f'-2:{size}'}[v{i}]")
+
+    cmd = [
+        "nice", "-n", str(HLS_NICE),
+        FFMPEG_BIN, "-loglevel", "error", "-nostdin",
+        "-i", source,
+        "-filter_complex", ";".join(graph),
+    ]
+    stream_map = []
+    for i, (name, _, video_rate, audio_rate) in enumerate(rungs):
+        cmd += [
+            "-map", f"[v{i}]",
+            f"-b:v:{i}", str(video_rate),
+            f"-maxrate:v:{i}", str(video_rate * 11 // 10),
+            f"-bufsize:v:{i}", str(video_rate * 2),
+        ]
+        if has_audio:
+            cmd += ["-map", "0:a:0", f"-b:a:{i}", str(audio_rate)]
+        stream_map.append(f"v:{i},a:{i},name:{name}" if has_audio else f"v:{i},name:{name}")
+
+    cmd += [
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main", "-pix_fmt", "yuv420p",
+        "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-threads", str(threads),
+    ]
+    if has_audio:
+        cmd += ["-c:a", "aac", "-ac", "2"]
+    cmd += [
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_flags", "independent_segments",
+        "-hls_segment_filename", os.path.join(out_dir, "%v", "seg_%05d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        os.path.join(out_dir, "%v", "index.m3u8"),
+    ]
+    return cmd
+
+
+def _upload(s3, path, key):
+    s3.upload_file(path, S3_BUCKET, key, ExtraArgs={"ContentType": hls_mimetype(key)})
+
+
+# Segments first, then the rung playlists, the master and finally the
+# marker, so nothing in S3 ever points at a file that isn't there yet.
+# Files left over from an earlier transcode (a rung or segments that no
+# longer exist) are removed afterwards.
+def upload_hls(s3, filename, out_dir, marker):
+    prefix = hls_prefix(filename)
+    stale = set()
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        stale.update(obj["Key"] for obj in page.get("Contents", []))
+
+    files = []
+    for root, _, names in os.walk(out_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((path, prefix + os.path.relpath(path, out_dir).replace(os.sep, "/")))
+    segments = [(path, key) for path, key in files if not key.endswith(".m3u8")]
+    playlists = sorted((f for f in files if f[1].endswith(".m3u8")), key=lambda f: f[1].endswith("/master.m3u8"))
+
+    with ThreadPoolExecutor(max_workers=HLS_UPLOAD_WORKERS) as pool:
+        list(pool.map(lambda f: _upload(s3, *f), segments))
+    for path, key in playlists:
+        _upload(s3, path, key)
+    s3.put_object(
+        Bucket=S3_BUCKET, Key=marker_key(filename),
+        Body=json.dumps(marker).encode("utf-8"), ContentType="application/json",
+    )
+
+    stale -= {key for _, key in files}
+    stale.discard(marker_key(filename))
+    stale = sorted(stale)
+    for i in range(0, len(stale), 1000):
+        s3.delete_objects(Bucket=S3_BUCKET, Delete={"Objects": [{"Key": k} for k in stale[i:i + 1000]]})
+
+
+# Downloads the original to a scratch directory (the transcode reads all of
+# it anyway), transcodes and uploads. Everything local is gone afterwards.
+def transcode_video(s3, filename):
+    with tempfile.TemporaryDirectory(prefix="hls-") as work:
+        source = os.path.join(work, "original" + os.path.splitext(filename)[1].lower())
+        s3.download_file(S3_BUCKET, video_key(filename), source)
+        metadata = video_metadata(probe(source))
+        width, height = metadata.get("width"), metadata.get("height")
+        rungs = ladder_for(width, height)
+
+        out_dir = os.path.join(work, "hls")
+        cmd = hls_command(
+            source, out_dir, rungs,
+            portrait=bool(width and height and height > width),
+            has_audio=metadata.get("audio_codec") is not None,
+        )
+        for name, *_ in rungs:
+            os.makedirs(os.path.join(out_dir, name))
+        result = subprocess.run(cmd, capture_output=True, timeout=HLS_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        os.remove(source)
+
+        upload_hls(s3, filename, out_dir, {
+            "renditions": [name for name, *_ in rungs],
+            "duration": metadata.get("duration"),
+            "segment_seconds": HLS_SEGMENT_SECONDS,
+        })
+    return filename
+
+
+# --- ON DEMAND ---
+# Runs in a BackgroundJob thread (see hls_job); waits for a free transcode
+# slot in this process.
+def transcode_on_demand(job, s3, filename):
+    job.begin(1, filename=filename)
+    with transcode_slots:
+        transcode_video(s3, filename)
+    job.advance(True)
+    job.finish()
+
+
+# --- BATCH JOB ---
+# Every video without an up-to-date HLS ladder. Re-runs skip finished
+# videos and redo ones that were interrupted; a video that an on-demand
+# transcode is working on is left to it.
+BUSY = "busy"
+
+def _transcode_batch_item(s3, filename):
+    video_job = hls_job(filename)
+    if not video_job.try_acquire():
+        return filename, BUSY
+    try:
+        transcode_video(s3, filename)
+        return filename, None
+    except Exception as e:
+        return filename, e
+    finally:
+        video_job.release()
+
+
+def generate_hls(job, s3, filenames=None, workers=HLS_WORKERS):
+    listing = list_videos(s3)
+    markers = list_markers(s3)
+    if filenames is None:
+        filenames = sorted(listing)
+    missing = [
+        f for f in filenames
+        if f in listing and not is_ready(markers.get(f), listing[f]["last_modified"])
+    ]
+    job.begin(len(missing), skipped=len(filenames) - len(missing), workers=workers)
+    print(f"[JOB] {job.name}: {len(missing)} of {len(filenames)} videos need HLS renditions")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for filename, error in pool.map(lambda f: _transcode_batch_item(s3, f), missing):
+            if error is None:
+                job.advance(True, last=filename)
+            elif error is BUSY:
+                job.advance(True, last=filename, busy=job.state.get("busy", 0) + 1)
+            else:
+                print(f"[JOB] Failed to transcode {filename}: {error}")
+                job.advance(False, last_error=f"{filename}: {error}")
+
+    job.finish()
+    return job.state
+
+
+# --- CLI ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcode videos into an HLS ladder under cache-hls/")
+    parser.add_argument("filenames", nargs="*", help="videos under videos/originals/ (default: all)")
+    parser.add_argument("--workers", type=int, default=HLS_WORKERS)
+    args = parser.parse_args()
+
+    state = run_cli(HLS_JOB, generate_hls, make_s3_client(), filenames=args.filenames or None, workers=args.workers)
+    print(f"✅ Transcoded {state['done']} videos ({state['failed']} failed, {state['skipped']} already done)")
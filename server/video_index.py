@@ -0,0 +1,237 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import BackgroundJob, run_cli
+from index_db import IndexDB, PHOTO_INDEX_DB
+from index_reconcile import object_metadata
+from s3_client import make_s3_client
+from video_thumbnails import S3_VIDEO_ORIGINALS_PREFIX, VIDEO_EXTENSIONS, video_key, presigned_url, probe
+
+S3_BUCKET = "photo-video-repository"
+VIDEO_INDEX_JOB = "video-index"
+# ffprobe mostly waits on ranged reads from S3, so this can exceed the cores
+VIDEO_PROBE_WORKERS = int(os.getenv("VIDEO_PROBE_WORKERS", "8"))
+# Seconds before the list endpoint starts a background refresh
+VIDEO_INDEX_MAX_AGE = int(os.getenv("VIDEO_INDEX_MAX_AGE", "300"))
+PROBE_SAVE_BATCH = 100
+
+VIDEO_SORT_FIELDS = ("filename", "duration", "size", "last_modified", "width", "height")
+PROBE_FIELDS = ("duration", "width", "height", "codec", "audio_codec", "fps")
+
+
+# --- LISTING ---
+# {filename: {etag, size, last_modified}} for every video under videos/originals/
+def list_videos(s3):
+    listing = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=S3_VIDEO_ORIGINALS_PREFIX):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.lower().endswith(VIDEO_EXTENSIONS) and not key.endswith("/"):
+                listing[key[len(S3_VIDEO_ORIGINALS_PREFIX):]] = object_metadata(obj)
+    return listing
+
+
+def listed_entry(filename, meta):
+    return {"filename": filename, **meta, "probed": False, **dict.fromkeys(PROBE_FIELDS)}
+
+
+def same_object(entry, meta):
+    return entry is not None and all(entry.get(k) == meta[k] for k in ("etag", "size", "last_modified"))
+
+
+# Brings the stored index in line with a listing: new or replaced objects
+# get a fresh, unprobed entry; videos gone from S3 are dropped. Diffed
+# against the database inside the write transaction, so it is safe to run
+# from several workers at once. Returns (changed, removed).
+def apply_listing(store, listing):
+    with store.transaction():
+        stored = {e["filename"]: e for e in store.load_videos()[1]}
+        if not listing and stored:
+            # Never wipe the index because of a bad prefix or an empty response
+            raise RuntimeError("S3 listing of video originals came back empty")
+        changed = [listed_entry(f, meta) for f, meta in listing.items() if not same_object(stored.get(f), meta)]
+        removed = [f for f in stored if f not in listing]
+        store.save_videos(changed, removed, listed=True)
+    return changed, removed
+
+
+# --- PROBING ---
+def _rotation(stream):
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(side_data["rotation"])
+    try:
+        return int(stream.get("tags", {}).get("rotate", 0))
+    except ValueError:
+        return 0
+
+
+def _fps(stream):
+    num, _, den = (stream.get("avg_frame_rate") or "0/0").partition("/")
+    try:
+        return round(int(num) / int(den), 2) if int(den) else None
+    except ValueError:
+        return None
+
+
+# Probe fields from ffprobe's JSON. Width and height are as displayed, so a
+# portrait phone video (stored landscape with a 90° rotation) is taller
+# than wide.
+def video_metadata(info):
+    streams = info.get("streams", [])
+    video = next((
+        s for s in streams
+        if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")
+    ), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    try:
+        duration = round(float(info.get("format", {})["duration"]), 3)
+    except (KeyError, ValueError):
+        duration = None
+
+    metadata = {"duration": duration, "audio_codec": audio.get("codec_name") if audio else None}
+    if video:
+        width, height = video.get("width"), video.get("height")
+        if _rotation(video) % 180:
+            width, height = height, width
+        metadata.update(codec=video.get("codec_name"), width=width, height=height, fps=_fps(video))
+    return metadata
+
+
+# Failures are recorded on the entry (probe_error) instead of retried on
+# every refresh; a new upload of the object, or --reprobe, tries again.
+def probe_entry(s3, entry):
+    try:
+        info = probe(presigned_url(s3, S3_BUCKET, video_key(entry["filename"])))
+        probed = {**entry, **video_metadata(info), "probed": True}
+        probed.pop("probe_error", None)
+        return probed, None
+    except Exception as e:
+        return {**entry, "probed": True, "probe_error": str(e)}, e
+
+
+# --- JOB ---
+# Lists videos/originals/ once, applies the diff, then runs ffprobe over
+# every entry that hasn't been probed yet. Probe results are saved in
+# batches, so an interrupted run resumes with what is still unprobed.
+def refresh_video_index(job, store, s3, workers=VIDEO_PROBE_WORKERS, reprobe=False):
+    start = time.perf_counter()
+    changed, removed = apply_listing(store, list_videos(s3))
+    entries = store.load_videos()[1]
+    pending = [e for e in entries if reprobe or not e.get("probed")]
+    job.begin(len(pending), listed=len(entries), changed=len(changed), removed=len(removed))
+    print(f"[JOB] {job.name}: {len(changed)} new or changed, {len(removed)} removed, {len(pending)} to probe")
+
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for entry, error in pool.map(lambda e: probe_entry(s3, e), pending):
+            if error is not None:
+                print(f"[JOB] Failed to probe {entry['filename']}: {error}")
+            job.advance(error is None, last=entry["filename"])
+            batch.append(entry)
+            if len(batch) >= PROBE_SAVE_BATCH:
+                store.save_videos(batch)
+                batch = []
+    if batch:
+        store.save_videos(batch)
+
+    job.finish(total_seconds=round(time.perf_counter() - start, 2))
+    return job.state
+
+
+# Called from the list endpoint. An index that has never been listed is
+# filled inline (one paginated listing, no probing), so the first request
+# after a deploy doesn't come back empty. After that a stale index is
+# refreshed in the background while requests keep answering from memory;
+# each worker tries at most once per max_age, and the job lock keeps it to
+# one run across workers.
+def refresh_if_stale(index, s3, max_age=VIDEO_INDEX_MAX_AGE):
+    listed_at = index.store.videos_listed_at()
+    now = time.time()
+    if listed_at is None:
+        apply_listing(index.store, list_videos(s3))
+    elif now - listed_at < max_age or now - index.refresh_started < max_age:
+        return
+    index.refresh_started = now
+    BackgroundJob(VIDEO_INDEX_JOB).start_in_thread(refresh_video_index, index.store, s3)
+
+
+# --- VIDEO INDEX ---
+# Per-worker copy of the videos table. sync() is one meta lookup; when the
+# store's write counter moved, the whole table is reloaded (it holds one
+# small row per video). Sorted orders are built on first use per version.
+class VideoIndex:
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = {}
+        self.orders = {}
+        self.refresh_started = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sync(self):
+        if self.store.videos_version() == self.version:
+            return
+        with self.lock:
+            version, entries = self.store.load_videos()
+            self.entries = {e["filename"]: e for e in entries}
+            self.orders = {}
+            self.version = version
+
+    def get(self, filename):
+        return self.entries.get(filename)
+
+    # Videos without a value for the sort field (not probed yet) go last
+    # in either direction.
+    def ordered(self, sort="filename", descending=False):
+        key = (sort, descending)
+        order = self.orders.get(key)
+        if order is None:
+            known = [e for e in self.entries.values() if e.get(sort) is not None]
+            unknown = [e for e in self.entries.values() if e.get(sort) is None]
+            known.sort(key=lambda e: (e[sort], e["filename"]), reverse=descending)
+            unknown.sort(key=lambda e: e["filename"])
+            order = self.orders[key] = known + unknown
+        return order
+
+    # Returns (entries, total, next_offset). next_offset is None once the
+    # matches are exhausted; pass it back as `offset` to continue.
+    def query(self, sort="filename", descending=False, offset=0, limit=None, folder=None, codec=None,
+              min_duration=None, max_duration=None, min_height=None, max_height=None):
+        def matches(e):
+            if folder and not e["filename"].startswith(folder.rstrip("/") + "/"):
+                return False
+            if codec and e.get("codec") != codec:
+                return False
+            for value, low, high in ((e.get("duration"), min_duration, max_duration), (e.get("height"), min_height, max_height)):
+                if (low is not None or high is not None) and value is None:
+                    return False
+                if low is not None and value < low or high is not None and value > high:
+                    return False
+            return True
+
+        found = [e for e in self.ordered(sort, descending) if matches(e)]
+        end = len(found) if limit is None else offset + limit
+        return found[offset:end], len(found), end if end < len(found) else None
+
+
+# --- CLI ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the video index from videos/originals/ in S3")
+    parser.add_argument("--workers", type=int, default=VIDEO_PROBE_WORKERS)
+    parser.add_argument("--reprobe", action="store_true", help="run ffprobe again on every video")
+    parser.add_argument("--db", default=PHOTO_INDEX_DB)
+    args = parser.parse_args()
+
+    state = run_cli(
+        VIDEO_INDEX_JOB, refresh_video_index, IndexDB(args.db), make_s3_client(),
+        workers=args.workers, reprobe=args.reprobe,
+    )
+    print(f"✅ Indexed {state['listed']} videos, probed {state['done']} ({state['failed']} failed)")
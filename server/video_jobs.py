@@ -0,0 +1,96 @@
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import run_bounded, run_cli
+from s3_client import make_s3_client
+from index_db import IndexDB, PHOTO_INDEX_DB
+from thumbnail_jobs import list_existing_keys
+from video_index import VideoIndex, apply_listing, list_videos
+from video_thumbnails import (
+    S3_VIDEO_THUMB_PREFIX,
+    video_key,
+    poster_key,
+    sprite_key,
+    sprite_index_key,
+    presigned_url,
+    probe_duration,
+    poster_frame,
+    render_sprite,
+)
+
+S3_BUCKET = "photo-video-repository"
+VIDEO_THUMB_JOB = "video-thumbnails"
+# ffmpeg runs in subprocesses, so threads are enough to keep cores busy
+VIDEO_JOB_WORKERS = int(os.getenv("VIDEO_JOB_WORKERS", str(os.cpu_count() or 2)))
+
+
+# --- LISTING ---
+# [(filename, make poster?, make sprite?, duration)] for the video index
+# entries (what /video-index/list returns) missing either. `existing` is
+# one listing of cache-video/ instead of a HEAD per video.
+def find_missing(videos, existing):
+    missing = []
+    for video in videos:
+        filename = video["filename"]
+        poster = poster_key(filename) not in existing
+        sprite = sprite_key(filename) not in existing or sprite_index_key(filename) not in existing
+        if poster or sprite:
+            missing.append((filename, poster, sprite, video.get("duration")))
+    return missing
+
+
+# --- TASK ---
+# Poster, then sprite sheet and its index (uploaded last, so an index in S3
+# always has its sheet). Both read the video through one presigned URL. The
+# duration comes from the video index; videos it hasn't probed yet are
+# probed here.
+def generate_video_assets(s3, filename, poster=True, sprite=True, duration=None):
+    url = presigned_url(s3, S3_BUCKET, video_key(filename))
+    if poster:
+        s3.put_object(Bucket=S3_BUCKET, Key=poster_key(filename), Body=poster_frame(url), ContentType="image/jpeg")
+    if sprite:
+        duration = duration or probe_duration(url)
+        if not duration:
+            raise RuntimeError("unknown duration, no sprite")
+        sheet, index = render_sprite(url, duration)
+        s3.put_object(Bucket=S3_BUCKET, Key=sprite_key(filename), Body=sheet, ContentType="image/jpeg")
+        s3.put_object(
+            Bucket=S3_BUCKET, Key=sprite_index_key(filename),
+            Body=json.dumps(index).encode("utf-8"), ContentType="application/json",
+        )
+    return filename
+
+
+# --- JOB ---
+# Re-runs are idempotent and resume where the last run stopped: videos whose
+# poster, sprite and index are all under cache-video/ are skipped.
+def generate_video_thumbnails(job, s3, videos, workers=VIDEO_JOB_WORKERS):
+    missing = find_missing(videos, list_existing_keys(s3, prefixes=(S3_VIDEO_THUMB_PREFIX,)))
+    job.begin(len(missing), skipped=len(videos) - len(missing), workers=workers)
+    print(f"[JOB] {job.name}: {len(missing)} of {len(videos)} videos need thumbnails")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        run_bounded(job, pool, lambda *item: generate_video_assets(s3, *item), missing, workers * 2)
+
+    job.finish()
+    return job.state
+
+
+# --- CLI ---
+# Works from the video index in the database (`python video_index.py`
+# refreshes it); an index that was never listed is listed first.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate missing video posters and scrubbing sprites")
+    parser.add_argument("--workers", type=int, default=VIDEO_JOB_WORKERS)
+    parser.add_argument("--db", default=PHOTO_INDEX_DB)
+    args = parser.parse_args()
+
+    s3 = make_s3_client()
+    index = VideoIndex(IndexDB(args.db))
+    if index.store.videos_listed_at() is None:
+        apply_listing(index.store, list_videos(s3))
+    index.sync()
+    state = run_cli(VIDEO_THUMB_JOB, generate_video_thumbnails, s3, index.ordered(), workers=args.workers)
+    print(f"✅ Generated thumbnails for {state['done']} videos ({state['failed']} failed, {state['per_second']}/s)")
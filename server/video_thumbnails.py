@@ -0,0 +1,168 @@
+import os
+import json
+import subprocess
+from io import BytesIO
+from PIL import Image
+
+# --- VIDEO KEYS ---
+S3_VIDEO_ORIGINALS_PREFIX = "videos/originals/"
+S3_VIDEO_THUMB_PREFIX = "cache-video"
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+# Originals are uploaded without a Content-Type (S3 says binary/octet-stream),
+# which some browsers won't play
+VIDEO_MIMETYPES = {
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".avi": "video/x-msvideo",
+    ".mkv": "video/x-matroska",
+}
+
+def video_key(filename):
+    return f"{S3_VIDEO_ORIGINALS_PREFIX}{filename}"
+
+def poster_key(filename):
+    return f"{S3_VIDEO_THUMB_PREFIX}/{filename}.jpg"
+
+# Scrubbing previews: one JPEG of tiled frames plus a JSON timing index
+def sprite_key(filename):
+    return f"{S3_VIDEO_THUMB_PREFIX}/{filename}.sprite.jpg"
+
+def sprite_index_key(filename):
+    return f"{S3_VIDEO_THUMB_PREFIX}/{filename}.sprite.json"
+
+def video_mimetype(filename):
+    return VIDEO_MIMETYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+def cache_mimetype(key):
+    return "application/json" if key.endswith(".json") else "image/jpeg"
+
+
+# --- VIDEO THUMBNAIL CONFIGURATION ---
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "60"))
+FFMPEG_RW_TIMEOUT_US = 15 * 1000 * 1000   # per network read/write
+VIDEO_THUMB_SECONDS = 2
+PRESIGNED_URL_SECONDS = 600
+
+SPRITE_COLUMNS = 5
+SPRITE_ROWS = 5
+SPRITE_TILE_WIDTH = 160
+
+
+def presigned_url(s3, bucket, key, expires=PRESIGNED_URL_SECONDS):
+    return s3.generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires)
+
+
+# Errors name the object without the presigned query string, so signatures
+# don't end up in logs or job status.
+def _run(cmd, timeout, url):
+    result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    if result.returncode != 0:
+        error = result.stderr.decode("utf-8", "replace").replace(url, url.split("?", 1)[0]).strip()
+        raise RuntimeError(f"{os.path.basename(cmd[0])} failed: {error}")
+    return result.stdout
+
+
+# Container and stream metadata; reads the index only, not the media
+def probe(url, timeout=FFMPEG_TIMEOUT):
+    return json.loads(_run([
+        FFPROBE_BIN,
+        "-v", "error",
+        "-rw_timeout", str(FFMPEG_RW_TIMEOUT_US),
+        "-show_format",
+        "-show_streams",
+        "-of", "json",
+        url,
+    ], timeout, url))
+
+
+def probe_duration(url):
+    try:
+        return float(probe(url)["format"]["duration"])
+    except (KeyError, ValueError):
+        return None
+
+
+# --- FRAME EXTRACTION ---
+# ffmpeg opens the video over HTTP(S) from a presigned URL instead of a
+# downloaded copy. Its HTTP input is seekable through Range requests, so it
+# reads the container index (the moov atom, wherever it sits in the file)
+# and then only the packets around the keyframe before `at`, and stops
+# after one frame. Bytes transferred and time don't grow with the video's
+# length. The JPEG comes back on stdout; nothing touches the disk.
+# With exact=False the keyframe at or before `at` is used as is, so nothing
+# past it is read or decoded.
+def extract_frame(url, at=VIDEO_THUMB_SECONDS, width=None, exact=True, timeout=FFMPEG_TIMEOUT):
+    scale = ["-vf", f"scale={width}:-2"] if width else []
+    return _run([
+        FFMPEG_BIN,
+        "-loglevel", "error",
+        "-rw_timeout", str(FFMPEG_RW_TIMEOUT_US),
+        *([] if exact else ["-noaccurate_seek"]),
+        "-ss", str(at),           # input seek: jump via the index, don't decode from 0
+        "-i", url,
+        "-an", "-sn", "-dn",
+        *scale,
+        "-frames:v", "1",
+        "-q:v", "2",
+        "-f", "image2pipe",
+        "-c:v", "mjpeg",
+        "pipe:1",
+    ], timeout, url)
+
+
+# JPEG for the frame at VIDEO_THUMB_SECONDS, or the first frame for videos
+# shorter than that.
+def poster_frame(url):
+    frame = extract_frame(url)
+    if not frame:
+        frame = extract_frame(url, at=0)
+    if not frame:
+        raise RuntimeError("ffmpeg produced no frame")
+    return frame
+
+
+def video_thumbnail(s3, bucket, key):
+    return poster_frame(presigned_url(s3, bucket, key))
+
+
+# --- SPRITE SHEETS ---
+# columns x rows frames, evenly spaced over the video, tiled into one JPEG.
+# Each frame is a separate extract_frame seek, so the sheet costs a few
+# ranged reads per frame however long the video is (a single ffmpeg with
+# one input per frame keeps demuxing every input until the whole graph is
+# done). Returns the JPEG and its index: frame i covers
+# [t_i, t_i + interval) and sits at (x, y) in the sheet.
+def render_sprite(url, duration, columns=SPRITE_COLUMNS, rows=SPRITE_ROWS, tile_width=SPRITE_TILE_WIDTH):
+    count = columns * rows
+    interval = duration / count
+    tiles = []
+    for i in range(count):
+        # sample the middle of each slot, away from black first/last frames
+        data = extract_frame(url, at=f"{(i + 0.5) * interval:.3f}", width=tile_width, exact=False)
+        tiles.append(Image.open(BytesIO(data)) if data else None)
+    if not any(tiles):
+        raise RuntimeError("ffmpeg produced no frames")
+
+    tile_height = next(tile for tile in tiles if tile).size[1]
+    sheet = Image.new("RGB", (tile_width * columns, tile_height * rows))
+    frames = []
+    for i, tile in enumerate(tiles):
+        x, y = (i % columns) * tile_width, (i // columns) * tile_height
+        if tile:
+            sheet.paste(tile, (x, y))
+        frames.append({"t": round(i * interval, 3), "x": x, "y": y})
+
+    buffer = BytesIO()
+    sheet.save(buffer, format="JPEG", quality=80)
+    index = {
+        "duration": round(duration, 3),
+        "interval": round(interval, 3),
+        "columns": columns,
+        "rows": rows,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+        "frames": frames,
+    }
+    return buffer.getvalue(), index